@@ -0,0 +1,72 @@
+"""
+bench/outline_bench.py
+Title outline: per-offset draw.text (old) vs text.outline_mask (new) timings.
+That the two renders match is checked by tests/test_text.py.
+
+    cd backend && python -m bench.outline_bench
+"""
+import argparse
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from pipeline import text as text_layout
+from pipeline.compose import TITLE_FONTS
+
+INK = (0, 0, 0, 220)
+
+
+def load_font(size: int):
+    for fp in TITLE_FONTS + ["/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"]:
+        try:
+            return ImageFont.truetype(fp, size)
+        except OSError:
+            continue
+    raise SystemExit("no TrueType font available")
+
+
+def old_outline(size, font, line, x, y, r):
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for dx in range(-r, r + 1, 2):
+        for dy in range(-r, r + 1, 2):
+            if dx == 0 and dy == 0:
+                continue
+            draw.text((x + dx, y + dy), line, font=font, fill=INK)
+    return overlay
+
+
+def new_outline(size, font, line, x, y, r):
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    mask, (ox, oy) = text_layout.outline_mask(font, line, r, 2)
+    overlay.paste(INK, (x + ox, y + oy), mask)
+    return overlay
+
+
+def timed(fn, *args, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    size = (768, 1024)
+    print(f"{'font px':>7} {'radius':>6} {'old ms':>8} {'new ms':>8} {'speedup':>8}")
+    for px in (48, 72, 92):
+        font = load_font(px)
+        line = "Dinosaur Adventure"
+        r    = max(4, int((font.getbbox("Ag")[3] + 20) * 0.09))
+        _, t_old = timed(old_outline, size, font, line, 40, 60, r, repeat=args.repeat)
+        _, t_new = timed(new_outline, size, font, line, 40, 60, r, repeat=args.repeat)
+        print(f"{px:>7} {r:>6} {t_old * 1e3:>8.1f} {t_new * 1e3:>8.1f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
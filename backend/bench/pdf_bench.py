@@ -0,0 +1,99 @@
+"""
+bench/pdf_bench.py
+Peak RSS and output size of the streaming PDF writer vs the old
+Pillow save_all path, on synthetic 768×1024 pages. The streaming writer
+encodes pages in the CPU pool, so its peak includes the pool workers' peaks
+(summed, so an upper bound).
+
+    cd backend && python -m bench.pdf_bench --pages 20 60
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from pipeline.pdf import PDF_PROFILES, write_pdf
+
+
+def make_pages(folder: Path, n: int):
+    paths = []
+    for i in range(n):
+        img = Image.effect_noise((768, 1024), 60 + i % 40).convert("RGB")
+        img = img.filter(ImageFilter.GaussianBlur(3))
+        d = ImageDraw.Draw(img)
+        d.rounded_rectangle([(38, 700), (730, 1000)], radius=22, fill=(214, 186, 140))
+        d.text((60, 720), f"Page {i+1} " * 8, fill=(45, 30, 15))
+        p = folder / f"page_{i+1}.png"
+        img.save(p)
+        paths.append(p)
+    return paths
+
+
+def _pillow_save_all(paths, out):
+    imgs = []
+    for p in paths:
+        img = Image.open(p).convert("RGB")
+        if img.size != (768, 1024):
+            img = img.resize((768, 1024), Image.LANCZOS)
+        imgs.append(img)
+    imgs[0].save(str(out), "PDF", resolution=150.0, save_all=True, append_images=imgs[1:])
+
+
+def _workers_peak_kb() -> int:
+    total = 0
+    for p in mp.active_children():                  # CPU pool workers are still alive here
+        try:
+            with open(f"/proc/{p.pid}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        except (OSError, StopIteration, ValueError):
+            pass
+    return total
+
+
+def _run(kind, paths, out, q):
+    t0 = time.perf_counter()
+    if kind == "pillow":
+        _pillow_save_all(paths, out)
+    else:
+        write_pdf(paths, out, kind)
+    elapsed = time.perf_counter() - t0
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss_kb //= 1024
+    rss_kb += _workers_peak_kb()
+    q.put((elapsed, rss_kb, out.stat().st_size))
+
+
+def measure(kind, paths, out):
+    # A fresh process per run so ru_maxrss is that run's own peak
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(kind, paths, out, q))
+    proc.start()
+    result = q.get()
+    proc.join()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, nargs="+", default=[5, 20, 60])
+    args = ap.parse_args()
+
+    print(f"{'pages':>5}  {'writer':<8} {'seconds':>8} {'peak RSS MiB':>13} {'size KiB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        pages = make_pages(tmp, max(args.pages))
+        for n in args.pages:
+            for kind in ["pillow", *PDF_PROFILES]:
+                secs, rss_kb, size = measure(kind, pages[:n], tmp / f"{kind}_{n}.pdf")
+                print(f"{n:>5}  {kind:<8} {secs:>8.2f} {rss_kb / 1024:>13.1f} {size / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
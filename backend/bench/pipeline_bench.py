@@ -0,0 +1,166 @@
+"""
+bench/pipeline_bench.py
+End-to-end run_images → run_regen_page → run_finalize against the offline
+fake xAI backend (pipeline/fake_xai.py). Reports wall-clock, CPU (including
+ffmpeg children and the CPU pool's workers) and the pipeline process's peak
+RSS per phase for 5-, 20- and 60-page books; each book runs in a fresh
+process so nothing is warm from the previous one.
+
+Rate limits are lifted by default so the numbers show pipeline overhead; pass
+--real-rates to keep the governor's configured limits, and --trace DIR to keep
+each job's Chrome trace.
+
+    cd backend && python -m bench.pipeline_bench --pages 5 20 60 --latency 0.02
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _reset_peak() -> bool:
+    """Linux lets a process reset its own high-water RSS mark."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def _cpu() -> float:
+    s, c = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    total = s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+    for p in mp.active_children():                  # CPU pool workers stay alive between phases
+        try:
+            with open(f"/proc/{p.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+def make_book(proj: Path, n: int):
+    from PIL import Image
+
+    for rel, color in (("assets/characters/hero.png", (200, 80, 60)),
+                       ("assets/locations/park_a.png", (60, 160, 80))):
+        (proj / rel).parent.mkdir(parents=True, exist_ok=True)
+        Image.effect_noise((1600, 1200), 50).convert("RGB").point(
+            lambda v, c=color: (v + c[0]) % 256).save(proj / rel)
+
+    pages = [{
+        "raw_description":    f"Hero explores the {'park' if i % 2 else 'sky'} on day {i + 1}",
+        "raw_narration_text": f"On day {i + 1} the hero went out to play and found something new",
+        "location":           "park" if i % 2 else "sky",
+        "include_characters": ["hero"],
+        "duration_seconds":   6,
+    } for i in range(n)]
+    manifest = {
+        "api_key": "bench",
+        "theme":   "light",
+        "title":   {"title_text": f"A {n}-Page Adventure", "raw_description": "A sunny cover scene"},
+        "assets":  {"characters": {"hero": {"path": "assets/characters/hero.png"}},
+                    "locations":  {"park": {"refs": ["assets/locations/park_a.png"]}, "sky": {}}},
+        "character_descriptions": {"hero": "a small explorer in a red coat"},
+        "pages":   pages,
+    }
+    (proj / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+
+
+def _run(n: int, opts: dict, q):
+    os.environ["XAI_BACKEND"]         = "fake"
+    os.environ["FAKE_XAI_LATENCY"]    = str(opts["latency"])
+    os.environ["FAKE_XAI_JITTER"]     = str(opts["jitter"])
+    os.environ["FAKE_XAI_ERROR_RATE"] = str(opts["error_rate"])
+    if not opts["verbose"]:
+        sys.stdout = open(os.devnull, "w")          # the job logger echoes every line
+    if not opts["real_rates"]:
+        for k in ("XAI_RATE_IMAGE", "XAI_RATE_CHAT", "XAI_RATE_VIDEO", "XAI_RATE_PER_KEY"):
+            os.environ[k] = "1000000"
+
+    from pipeline.fake_xai import fixture_server
+    from pipeline.generate import run_finalize, run_images, run_regen_page
+    from pipeline.jobs import MemoryJobStore
+
+    fixture_server()                                # render fixtures before anything is timed
+
+    jobs = MemoryJobStore()
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        proj = Path(root) / f"bench{n}"
+        proj.mkdir()
+        make_book(proj, n)
+        phases = [("images",   run_images,     ()),
+                  ("regen",    run_regen_page, (1, "add a rainbow")),
+                  ("finalize", run_finalize,   ())]
+        for name, fn, extra in phases:
+            job_id = f"{name}-{n}"
+            jobs.create(job_id, proj.name)
+            _reset_peak()
+            cpu0, t0 = _cpu(), time.perf_counter()
+            fn(proj.name, proj, job_id, jobs, *extra, trace=bool(opts["trace"]))
+            wall, cpu = time.perf_counter() - t0, _cpu() - cpu0
+            job = jobs.get(job_id, with_log=False)
+            rows.append((name, wall, cpu, _peak_kb(), job["status"],
+                         int((job.get("api") or {}).get("calls", 0)), job.get("error")))
+            if job.get("trace"):
+                shutil.copy(proj / job["trace"], Path(opts["trace"]) / f"{job_id}.json")
+    q.put(rows)
+
+
+def measure(n: int, opts: dict):
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(n, opts, q))
+    proc.start()
+    rows = q.get()
+    proc.join()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, nargs="+", default=[5, 20, 60])
+    ap.add_argument("--latency", type=float, default=0.02,
+                    help="multiplier on the fake API's realistic call times (1.0 = realistic)")
+    ap.add_argument("--jitter", type=float, default=0.3)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--real-rates", action="store_true")
+    ap.add_argument("--verbose", action="store_true", help="show the job logs")
+    ap.add_argument("--trace", metavar="DIR", help="save each job's Chrome trace here")
+    args = ap.parse_args()
+    opts = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            "real_rates": args.real_rates, "verbose": args.verbose, "trace": args.trace}
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+
+    print(f"{'pages':>5}  {'phase':<8} {'wall s':>7} {'cpu s':>7} {'peak RSS MiB':>13} "
+          f"{'api calls':>9}  status")
+    for n in args.pages:
+        for name, wall, cpu, peak_kb, status, calls, error in measure(n, opts):
+            print(f"{n:>5}  {name:<8} {wall:>7.2f} {cpu:>7.2f} {peak_kb / 1024:>13.1f} "
+                  f"{calls:>9}  {status}{f' ({error})' if error else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,32 @@
 """
 Storybook Generator — FastAPI Backend
 """
+import asyncio
+import hashlib
 import json
-import shutil
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
 import uuid
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile, BackgroundTasks
+import aiofiles
+from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from pipeline.generate import run_images, run_regen_page, run_finalize
+from pipeline import artifacts, cpu, ingest, metrics, thumbs
+from pipeline.cache import content_key, file_digest, write_json_atomic
+from pipeline.generate import (REF_MAX_SIDE_CHAR, REF_MAX_SIDE_LOC, run_finalize, run_images,
+                               run_regen_page)
+from pipeline.jobs import ACTIVE_STATUSES, open_job_store
+from pipeline.ratelimit import GOVERNOR
+from pipeline.scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, Scheduler
 
 app = FastAPI(title="Storybook Generator")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
@@ -19,7 +34,32 @@ app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], all
 PROJECTS_DIR = Path("/app/projects")
 PROJECTS_DIR.mkdir(exist_ok=True)
 
-job_status: dict[str, dict] = {}
+jobs      = open_job_store(PROJECTS_DIR / "jobs.sqlite3")
+scheduler = Scheduler(jobs)
+index     = artifacts.open_index(PROJECTS_DIR)
+threading.Thread(target=index.backfill, name="artifact-backfill", daemon=True).start()
+
+HTTP_SECONDS = metrics.Histogram("storybook_http_seconds", "Time to answer each API request.",
+                                 ("method", "route", "status"))
+metrics.Gauge("storybook_jobs_queued", "Jobs waiting for a slot in this worker's scheduler.", (),
+              lambda: {(): scheduler.stats()["queued"]})
+metrics.Gauge("storybook_jobs_active", "Jobs running in this worker.", (),
+              lambda: {(): scheduler.stats()["running"]})
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start    = time.perf_counter()
+    response = await call_next(request)
+    route    = request.scope.get("route")
+    if route is not None and request.url.path.startswith("/api/"):
+        # Route templates, not raw paths, so project and job ids don't multiply the series
+        HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                             route=route.path, status=response.status_code)
+    return response
+
+SSE_POLL_SECONDS      = 0.5
+SSE_HEARTBEAT_SECONDS = 15
 
 
 def get_project_dir(project_id: str) -> Path:
@@ -32,11 +72,31 @@ def get_project_dir(project_id: str) -> Path:
 def new_project():
     pid = str(uuid.uuid4())[:8]
     get_project_dir(pid)
+    index.touch(pid)
     return {"project_id": pid}
 
 
+@app.get("/api/projects")
+def list_projects(limit: int = 50, offset: int = 0):
+    """Projects on this volume, most recently updated first."""
+    return index.projects(max(1, min(limit, 500)), max(0, offset))
+
+
+UPLOAD_CHUNK = 1024 * 1024
+
+
+def _after_upload(project_id: str, proj: Path, dest: Path, digest: str):
+    """Index the upload and prepare the downscaled copies generation will ask for."""
+    index.record(project_id, proj, dest.relative_to(proj).as_posix(), "upload", digest)
+    try:
+        cpu.run(ingest.make_derivatives, proj, dest, (REF_MAX_SIDE_CHAR, REF_MAX_SIDE_LOC))
+    except OSError as e:
+        print(f"[ingest] {dest.name}: no derivatives ({e})", flush=True)
+
+
 @app.post("/api/projects/{project_id}/assets")
 async def upload_asset(
+    background: BackgroundTasks,
     project_id: str,
     asset_type: str = Form(...),
     slug: str = Form(...),
@@ -47,93 +107,306 @@ async def upload_asset(
     folder.mkdir(parents=True, exist_ok=True)
     ext  = Path(file.filename).suffix or ".png"
     dest = folder / f"{slug}{ext}"
-    with open(dest, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return {"ok": True, "path": str(dest.relative_to(proj))}
+
+    # Stream to a temp file in the blob store, hashing as we go
+    fd, tmp = tempfile.mkstemp(dir=ingest.blob_dir(proj), suffix=".part")
+    os.close(fd)
+    sha = hashlib.sha256()
+    try:
+        async with aiofiles.open(tmp, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK):
+                sha.update(chunk)
+                await f.write(chunk)
+        digest    = sha.hexdigest()
+        duplicate = await asyncio.to_thread(ingest.store, proj, Path(tmp), digest, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    background.add_task(_after_upload, project_id, proj, dest, digest)
+    return {"ok": True, "path": str(dest.relative_to(proj)), "sha256": digest, "duplicate": duplicate}
 
 
 @app.post("/api/projects/{project_id}/manifest")
 async def save_manifest(project_id: str, payload: dict):
     proj = get_project_dir(project_id)
-    with open(proj / "manifest.json", "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2)
+    await asyncio.to_thread(write_json_atomic, proj / "manifest.json", payload)
+    await asyncio.to_thread(index.touch, project_id, artifacts.manifest_title(payload))
     return {"ok": True}
 
 
 # ── Phase 1: generate images only ──────────────────────────────────────────────
-@app.post("/api/projects/{project_id}/generate-images")
-async def generate_images(project_id: str, background_tasks: BackgroundTasks):
+def _start_job(project_id: str, phase: str, priority: int, fn, *params) -> dict:
+    """
+    Queue a phase for the project. An identical request (same phase, parameters and
+    manifest) that is still queued or running is joined rather than started twice.
+    Hashes the manifest and takes a SQLite write lock, so call it from plain `def`
+    handlers (FastAPI's threadpool), never on the event loop.
+    """
     proj = get_project_dir(project_id)
     if not (proj / "manifest.json").exists():
         raise HTTPException(400, "No manifest found.")
     job_id = str(uuid.uuid4())[:8]
-    job_status[job_id] = {"status": "running", "project_id": project_id, "log": [], "progress": 0}
-    background_tasks.add_task(run_images, project_id, proj, job_id, job_status)
+    key    = content_key(phase, file_digest(proj / "manifest.json"), *map(str, params))
+    active = jobs.create_unique(job_id, project_id, key, status="queued", phase=phase)
+    if active != job_id:
+        return {"job_id": active, "existing": True}
+    scheduler.submit(job_id, project_id, priority, fn, project_id, proj, job_id, jobs, *params)
     return {"job_id": job_id}
 
 
+@app.post("/api/projects/{project_id}/generate-images")
+def generate_images(project_id: str, resume: bool = False, trace: bool = False):
+    """
+    With resume=true, pages whose inputs are unchanged since they were last built are kept.
+    With trace=true (on any phase), the job saves traces/<job_id>.json for Perfetto.
+    """
+    return _start_job(project_id, "images", PRIORITY_BULK, run_images, resume, trace)
+
+
 # ── Phase 1b: regenerate one page ──────────────────────────────────────────────
 @app.post("/api/projects/{project_id}/regen-page")
-async def regen_page(
+def regen_page(
     project_id: str,
-    background_tasks: BackgroundTasks,
     page_index: int = Form(...),
     extra_instruction: str = Form(""),
+    refresh_background: bool = Form(False),
+    trace: bool = False,
 ):
-    proj = get_project_dir(project_id)
-    if not (proj / "manifest.json").exists():
-        raise HTTPException(400, "No manifest found.")
-    job_id = str(uuid.uuid4())[:8]
-    job_status[job_id] = {"status": "running", "project_id": project_id, "log": [], "progress": 0}
-    background_tasks.add_task(
-        run_regen_page, project_id, proj, job_id, job_status, page_index, extra_instruction
-    )
-    return {"job_id": job_id}
+    return _start_job(project_id, "regen", PRIORITY_INTERACTIVE,
+                      run_regen_page, page_index, extra_instruction, refresh_background, trace)
 
 
 # ── Phase 2: finalize — PDF + video ────────────────────────────────────────────
 @app.post("/api/projects/{project_id}/finalize")
-async def finalize(project_id: str, background_tasks: BackgroundTasks):
-    proj = get_project_dir(project_id)
-    if not (proj / "manifest.json").exists():
-        raise HTTPException(400, "No manifest found.")
-    job_id = str(uuid.uuid4())[:8]
-    job_status[job_id] = {"status": "running", "project_id": project_id, "log": [], "progress": 0}
-    background_tasks.add_task(run_finalize, project_id, proj, job_id, job_status)
-    return {"job_id": job_id}
+def finalize(project_id: str, trace: bool = False):
+    return _start_job(project_id, "finalize", PRIORITY_NORMAL, run_finalize, trace)
 
 
 # ── Job polling ─────────────────────────────────────────────────────────────────
 @app.get("/api/jobs/{job_id}")
 def get_job(job_id: str):
-    if job_id not in job_status:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    if job["status"] in ACTIVE_STATUSES:
+        # This worker's view of the shared xAI limits: queue depth, throttling, breakers
+        job["governor"] = GOVERNOR.stats()
+    return job
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    if jobs.get(job_id, with_log=False) is None:
+        raise HTTPException(404, "Job not found")
+    return {"ok": scheduler.cancel(job_id)}
+
+
+def _sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# ── Job events (Server-Sent Events) ─────────────────────────────────────────────
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, after: int = 0):
+    """
+    Push a job's progress instead of making clients poll the whole job:
+      log       {seq, msg}        each new log line
+      progress  {progress}        whenever it changes
+      queue     {position}        queue position while waiting (null once started)
+      page      {page, url}       a page image finished (0 = title page)
+      status    {status, error?}  the job finished or was cancelled; the stream then ends
+    Log and page events carry the id "<log seq>:<pages sent>", so a client reconnecting
+    with Last-Event-ID (or ?after=<seq>) resumes both streams where it left off.
+    """
+    if await asyncio.to_thread(jobs.get, job_id, with_log=False, with_ready=False) is None:
         raise HTTPException(404, "Job not found")
-    return job_status[job_id]
+    last_id = request.headers.get("last-event-id", "")
+    m = re.fullmatch(r"(\d+)(?::(\d+))?", last_id)
+    start, start_pages = (int(m[1]), int(m[2] or 0)) if m else (after, 0)
+
+    def snapshot(seq: int, pages_sent: int):
+        # Read the job before its log: lines are written before the final status.
+        # The ready list is only read past what was sent, and only once it has grown.
+        job = jobs.get(job_id, with_log=False, with_ready=False)
+        if job is None:
+            return None, [], []
+        pages = jobs.ready_since(job_id, pages_sent) if job["ready_count"] > pages_sent else []
+        return job, jobs.log_since(job_id, seq), pages
+
+    async def stream():
+        seq, progress, pages_sent, position = start, None, start_pages, -1
+        quiet = 0.0
+        while not await request.is_disconnected():
+            # SQLite reads happen in a thread so many watchers don't stall the event loop
+            job, lines, pages = await asyncio.to_thread(snapshot, seq, pages_sent)
+            if job is None:
+                yield _sse("status", {"status": "expired"})
+                return
+            sent = False
+            for s, msg in lines:
+                seq = s
+                sent = True
+                yield _sse("log", {"seq": s, "msg": msg}, f"{s}:{pages_sent}")
+            if job["progress"] != progress:
+                progress = job["progress"]
+                sent = True
+                yield _sse("progress", {"progress": progress})
+            if job.get("queue_position") != position:
+                position = job.get("queue_position")
+                sent = True
+                yield _sse("queue", {"position": position})
+            for r in pages:
+                pages_sent += 1
+                sent = True
+                yield _sse("page", {"page": r["page"], "url":
+                    f"/api/projects/{job['project_id']}/files/{r['path']}?v={r['v']}"},
+                    f"{seq}:{pages_sent}")
+            if job["status"] not in ACTIVE_STATUSES:
+                final = {"status": job["status"]}
+                if "error" in job:
+                    final["error"] = job["error"]
+                yield _sse("status", final)
+                return
+            quiet = 0.0 if sent else quiet + SSE_POLL_SECONDS
+            if quiet >= SSE_HEARTBEAT_SECONDS:
+                quiet = 0.0
+                yield ": ping\n\n"
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # ── Outputs list ────────────────────────────────────────────────────────────────
+PAGE_IMAGE = re.compile(r"generated_images/page_\d+\.png")
+
+
 @app.get("/api/projects/{project_id}/outputs")
 def list_outputs(project_id: str):
-    proj   = get_project_dir(project_id)
-    pdf    = proj / "book_pdfs" / "story_book.pdf"
-    video  = proj / "final_video.mp4"
-    images = sorted((proj / "generated_images").glob("page_*.png")) if (proj / "generated_images").exists() else []
-    title  = proj / "generated_images" / "title_page.png"
+    """From the artifact index; URLs are versioned by content hash so they cache as immutable."""
+    index.refresh(project_id, PROJECTS_DIR / project_id)
+    found = {a["path"]: a for a in index.artifacts(project_id)}
+
+    def url(rel: str) -> Optional[str]:
+        a = found.get(rel)
+        return f"/api/projects/{project_id}/files/{rel}?v={artifacts.version(a['sha256'])}" if a else None
+
+    pages = [rel for rel in found if PAGE_IMAGE.fullmatch(rel)]     # already in page order
     return {
-        "pdf":    f"/api/projects/{project_id}/files/book_pdfs/story_book.pdf" if pdf.exists() else None,
-        "video":  f"/api/projects/{project_id}/files/final_video.mp4" if video.exists() else None,
-        "title":  f"/api/projects/{project_id}/files/generated_images/title_page.png" if title.exists() else None,
-        "images": [f"/api/projects/{project_id}/files/generated_images/{p.name}" for p in images],
+        "pdf":    url("book_pdfs/story_book.pdf"),
+        "video":  url("final_video.mp4"),
+        "title":  url("generated_images/title_page.png"),
+        "images": [url(rel) for rel in pages],
+        "traces": [url(rel) for rel in sorted(found) if rel.startswith("traces/")],
     }
 
 
 # ── File serving ────────────────────────────────────────────────────────────────
+FILE_CHUNK         = 256 * 1024
+CACHE_VERSIONED    = "public, max-age=31536000, immutable"   # ?v= is the file's current artifacts.version
+CACHE_REVALIDATE   = "no-cache"                               # always check the ETag
+
+
+def _etag(st) -> str:
+    return '"' + content_key(str(st.st_ino), str(st.st_mtime_ns), str(st.st_size))[:32] + '"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+def _byte_range(header: str, size: int):
+    """(start, end) inclusive for a single 'bytes=' range, None to ignore it, or raise 416."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None                                           # multipart ranges: send it all
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(416, "Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _iter_file(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _file_response(request: Request, path: Path, media_type: Optional[str] = None,
+                   version: Optional[str] = None):
+    """
+    Serve a file with a strong ETag, conditional GET and single byte-range support.
+    It is cached as immutable only when ?v= names `version`, the contents' current one.
+    """
+    st = path.stat()
+    etag = _etag(st)
+    v = request.query_params.get("v")
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": CACHE_VERSIONED if v and v == version else CACHE_REVALIDATE,
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and (not if_range or if_range == etag):
+        span = _byte_range(rng, st.st_size)
+        if span:
+            start, end = span
+            headers.update({"Content-Range": f"bytes {start}-{end}/{st.st_size}",
+                            "Content-Length": str(end - start + 1)})
+            return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=206,
+                                     media_type=media_type, headers=headers)
+    return FileResponse(str(path), media_type=media_type, headers=headers, stat_result=st)
+
+
 @app.get("/api/projects/{project_id}/files/{filename:path}")
-def serve_file(project_id: str, filename: str):
-    target = get_project_dir(project_id) / filename
-    if not target.exists():
+def serve_file(project_id: str, filename: str, request: Request,
+               w: Optional[int] = None, fmt: str = "webp"):
+    """
+    A project file. With ?w= an image is served as a cached thumbnail of that
+    width (snapped to THUMB_WIDTHS) in fmt: webp, jpeg or png.
+    """
+    proj   = get_project_dir(project_id)
+    target = (proj / filename).resolve()
+    if not target.is_relative_to(proj.resolve()) or not target.is_file():
         raise HTTPException(404, "File not found")
-    return FileResponse(str(target))
+    rel     = target.relative_to(proj.resolve()).as_posix()
+    # A thumbnail is versioned by its source, so the same ?v= serves every size
+    version = index.current_version(project_id, rel, target.stat()) if "v" in request.query_params else None
+    if w is None:
+        return _file_response(request, target, version=version)
+    if target.suffix.lower() not in thumbs.THUMB_SOURCES:
+        raise HTTPException(400, "Thumbnails are only available for images.")
+    if fmt not in thumbs.THUMB_FORMATS or w <= 0:
+        raise HTTPException(400, f"Unsupported thumbnail: w={w}, fmt={fmt}")
+    thumb = thumbs.thumbnail(proj, rel, w, fmt)
+    return _file_response(request, thumb, thumbs.THUMB_FORMATS[fmt][1], version)
+
+
+# ── Metrics ─────────────────────────────────────────────────────────────────────
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format: stage and xAI latency, retries, cache hits, bytes, queue depth."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # ── Serve React SPA ─────────────────────────────────────────────────────────────
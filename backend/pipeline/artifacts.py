@@ -0,0 +1,227 @@
+"""
+pipeline/artifacts.py
+Index of the files each project has produced, kept in one SQLite database at
+the root of the projects volume. The pipeline records an artifact (path,
+size, sha256, phase, time) whenever it writes one, so listing a project's
+outputs, or every project, is a query instead of a walk of the filesystem.
+Projects that predate the index are picked up by a one-off backfill, and
+any project whose directory changed after its last indexed write (copied
+in later, or a write that never reached the index) is rescanned on read.
+"""
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from .cache import file_digest, read_json
+
+ARTIFACT_DB   = "artifacts.sqlite3"
+VERSION_CHARS = 12      # of the sha256, in ?v= URL versions
+
+# Files worth indexing, relative to a project, with the phase that writes them
+_PATTERNS = (
+    ("generated_images/title_page.png", "images"),
+    ("generated_images/page_*.png",     "images"),
+    ("book_pdfs/*.pdf",                 "finalize"),
+    ("generated_videos/page_*.mp4",     "finalize"),
+    ("final_video.mp4",                 "finalize"),
+    ("assets/characters/*",             "upload"),
+    ("assets/locations/*",              "upload"),
+    ("traces/*.json",                   "trace"),
+)
+
+
+def natural_key(path: str):
+    """Sort key that orders page_2 before page_10."""
+    return [int(s) if s.isdigit() else s for s in re.split(r"(\d+)", path)]
+
+
+def version(sha256: str) -> str:
+    """The ?v= token for a file's contents; every versioned URL the API hands out uses it."""
+    return sha256[:VERSION_CHARS]
+
+
+def manifest_title(manifest: dict) -> Optional[str]:
+    cfg = manifest.get("title") if isinstance(manifest, dict) else None
+    return cfg.get("title_text") if isinstance(cfg, dict) else None
+
+
+class ArtifactIndex:
+    def __init__(self, root: Path):
+        self.root   = root
+        self.path   = root / ARTIFACT_DB
+        self._local = threading.local()
+        with self._conn() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS projects (
+                    project_id TEXT PRIMARY KEY,
+                    title      TEXT,
+                    created    REAL NOT NULL,
+                    updated    REAL NOT NULL,
+                    artifacts  INTEGER NOT NULL DEFAULT 0,
+                    bytes      INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    project_id TEXT NOT NULL,
+                    path       TEXT NOT NULL,
+                    phase      TEXT NOT NULL,
+                    size       INTEGER NOT NULL,
+                    sha256     TEXT NOT NULL,
+                    updated    REAL NOT NULL,
+                    PRIMARY KEY (project_id, path)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE INDEX IF NOT EXISTS projects_updated ON projects(updated);
+            """)
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _tx(self, fn):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(db)
+            db.execute("COMMIT")
+            return out
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _touch(db, project_id: str, now: float, title: Optional[str] = None):
+        db.execute("INSERT OR IGNORE INTO projects (project_id, created, updated) VALUES (?, ?, ?)",
+                   (project_id, now, now))
+        db.execute("UPDATE projects SET updated = ?, title = COALESCE(?, title) WHERE project_id = ?",
+                   (now, title, project_id))
+
+    @staticmethod
+    def _totals(db, project_id: str):
+        db.execute("""UPDATE projects SET
+                          artifacts = (SELECT COUNT(*) FROM artifacts WHERE project_id = ?1),
+                          bytes     = (SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE project_id = ?1)
+                      WHERE project_id = ?1""", (project_id,))
+
+    # ── writes ──
+    def touch(self, project_id: str, title: Optional[str] = None):
+        """Register a project, or bump its updated time (and title, when given)."""
+        self._tx(lambda db: self._touch(db, project_id, time.time(), title))
+
+    def record(self, project_id: str, proj: Path, rel: str, phase: str,
+               sha256: Optional[str] = None) -> str:
+        """Index proj/rel as just written by `phase` and return its sha256 (pass it if known)."""
+        path = proj / rel
+        size = path.stat().st_size
+        sha256 = sha256 or file_digest(path)
+
+        def write(db):
+            now = time.time()
+            self._touch(db, project_id, now)
+            db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                       (project_id, rel, phase, size, sha256, now))
+            self._totals(db, project_id)
+        self._tx(write)
+        return sha256
+
+    def forget(self, project_id: str, rel: str):
+        def write(db):
+            db.execute("DELETE FROM artifacts WHERE project_id = ? AND path = ?", (project_id, rel))
+            self._totals(db, project_id)
+        self._tx(write)
+
+    # ── reads ──
+    def refresh(self, project_id: str, proj: Path):
+        """Rescan proj if it isn't indexed yet or its directory changed after the last indexed write."""
+        if project_id.startswith("."):
+            return
+        try:
+            mtime = proj.stat().st_mtime
+        except OSError:
+            return
+        row = self._conn().execute("SELECT updated FROM projects WHERE project_id = ?",
+                                   (project_id,)).fetchone()
+        if row is None or row[0] < mtime:
+            self.scan(project_id, proj)
+
+    def artifacts(self, project_id: str) -> List[dict]:
+        rows = self._conn().execute(
+            "SELECT path, phase, size, sha256, updated FROM artifacts WHERE project_id = ?",
+            (project_id,),
+        ).fetchall()
+        out = [dict(zip(("path", "phase", "size", "sha256", "updated"), r)) for r in rows]
+        return sorted(out, key=lambda a: natural_key(a["path"]))
+
+    def current_version(self, project_id: str, rel: str, st) -> Optional[str]:
+        """rel's version token, unless the file (st = its stat) changed after it was indexed."""
+        row = self._conn().execute(
+            "SELECT sha256, size, updated FROM artifacts WHERE project_id = ? AND path = ?",
+            (project_id, rel),
+        ).fetchone()
+        if row and row[1] == st.st_size and row[2] >= st.st_mtime:
+            return version(row[0])
+        return None
+
+    def projects(self, limit: int = 50, offset: int = 0) -> dict:
+        db = self._conn()
+        total = db.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+        rows = db.execute(
+            "SELECT project_id, title, created, updated, artifacts, bytes FROM projects "
+            "ORDER BY updated DESC LIMIT ? OFFSET ?", (limit, offset),
+        ).fetchall()
+        keys = ("project_id", "title", "created", "updated", "artifacts", "bytes")
+        return {"total": total, "projects": [dict(zip(keys, r)) for r in rows]}
+
+    # ── backfill ──
+    def backfill(self):
+        """
+        Index every project directory the first time any worker starts; after that,
+        only directories the index has never seen. Later writes keep it current.
+        """
+        claimed = self._tx(lambda db: db.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('backfilled', ?)", (str(time.time()),)).rowcount)
+        known = {r[0] for r in self._conn().execute("SELECT project_id FROM projects")}
+        for proj in self.root.iterdir():
+            if proj.is_dir() and not proj.name.startswith(".") and (claimed or proj.name not in known):
+                self.scan(proj.name, proj)
+
+    def scan(self, project_id: str, proj: Path):
+        """Re-index one project from disk, dropping entries whose files are gone."""
+        self.touch(project_id, manifest_title(read_json(proj / "manifest.json", {})))
+        known = {a["path"]: a for a in self.artifacts(project_id)}
+        found = set()
+        for pattern, phase in _PATTERNS:
+            for p in proj.glob(pattern):
+                if p.is_file():
+                    rel = p.relative_to(proj).as_posix()
+                    found.add(rel)
+                    st, a = p.stat(), known.get(rel)
+                    # Rows written after the file last changed are current; skip re-hashing
+                    if not a or a["size"] != st.st_size or a["updated"] < st.st_mtime:
+                        self.record(project_id, proj, rel, phase)
+        for a in known.values():
+            if a["path"] not in found:
+                self.forget(project_id, a["path"])
+        # Date the project by its files, not by when it happened to be scanned
+        stamp = max([proj.stat().st_mtime] + [(proj / rel).stat().st_mtime for rel in found])
+        self._tx(lambda db: db.execute(
+            "UPDATE projects SET updated = ?1, created = MIN(created, ?1) WHERE project_id = ?2",
+            (stamp, project_id)))
+
+
+@lru_cache(maxsize=None)
+def open_index(root: Path) -> ArtifactIndex:
+    """The index for a projects volume, shared by the API and the pipeline."""
+    return ArtifactIndex(root)
+
+
+def index_for(proj: Path) -> ArtifactIndex:
+    return open_index(proj.parent)
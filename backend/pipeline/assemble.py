@@ -0,0 +1,155 @@
+"""
+pipeline/assemble.py
+Final video assembly. Clips that share codec parameters (down to H.264
+profile and level, time base and channel layout) are stream-copied through
+ffmpeg's concat demuxer; odd ones out are re-encoded to match first.
+moviepy is kept as a fallback for hosts without a working ffmpeg.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from . import cpu
+
+FFMPEG  = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+
+class ClipFormat(NamedTuple):
+    vcodec: str
+    width: int
+    height: int
+    pix_fmt: str
+    fps: str
+    profile: Optional[str]
+    level: Optional[int]
+    time_base: Optional[str]
+    acodec: Optional[str]
+    sample_rate: Optional[str]
+    channels: Optional[int]
+    channel_layout: Optional[str]
+
+
+# ffprobe's H.264 profile names, as libx264 spells them
+X264_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main",
+                 "High": "high", "High 10": "high10", "High 4:2:2": "high422",
+                 "High 4:4:4 Predictive": "high444"}
+
+
+def probe(path: Path) -> ClipFormat:
+    out = subprocess.run(
+        [FFPROBE, "-v", "error", "-show_streams", "-of", "json", str(path)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    streams = json.loads(out).get("streams", [])
+    v = next(s for s in streams if s.get("codec_type") == "video")
+    a = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    return ClipFormat(
+        v.get("codec_name"), int(v.get("width", 0)), int(v.get("height", 0)),
+        v.get("pix_fmt"), v.get("r_frame_rate"),
+        v.get("profile"), v.get("level"), v.get("time_base"),
+        a.get("codec_name"), a.get("sample_rate"), a.get("channels"), a.get("channel_layout"),
+    )
+
+
+def _target_format(formats: List[ClipFormat]) -> ClipFormat:
+    """Most common clip format, forced to h264/aac if the majority isn't already."""
+    ref = Counter(formats).most_common(1)[0][0]
+    if ref.vcodec != "h264" or ref.acodec not in (None, "aac"):
+        ref = ref._replace(vcodec="h264", pix_fmt="yuv420p", profile="High", level=None,
+                           acodec="aac" if ref.acodec else None)
+    return ref
+
+
+def _normalize(src: Path, dest: Path, fmt: ClipFormat, src_fmt: ClipFormat):
+    """Re-encode src with every parameter the concat demuxer needs to match fmt."""
+    w, h = fmt.width, fmt.height
+    vf = (f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+          f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,fps={fmt.fps},format={fmt.pix_fmt}")
+    cmd = [FFMPEG, "-y", "-v", "error", "-i", str(src)]
+    if fmt.acodec and src_fmt.acodec is None:
+        # Clips without a soundtrack get silence so every clip has the same streams
+        layout = fmt.channel_layout or ("mono" if fmt.channels == 1 else "stereo")
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={fmt.sample_rate}:cl={layout}",
+                "-map", "0:v:0", "-map", "1:a:0", "-shortest"]
+    if fmt.acodec:
+        af = f"aformat=sample_rates={fmt.sample_rate}"
+        if fmt.channel_layout:
+            af += f":channel_layouts={fmt.channel_layout}"
+        cmd += ["-af", af, "-c:a", "aac", "-ar", str(fmt.sample_rate), "-ac", str(fmt.channels)]
+    else:
+        cmd += ["-an"]
+    cmd += ["-vf", vf, "-c:v", "libx264", "-preset", "veryfast", "-crf", "18"]
+    if fmt.profile in X264_PROFILES:
+        cmd += ["-profile:v", X264_PROFILES[fmt.profile]]
+    if fmt.level and fmt.level > 0:
+        cmd += ["-level:v", f"{fmt.level // 10}.{fmt.level % 10}"]
+    if fmt.time_base and fmt.time_base.startswith("1/"):
+        # The mp4 track timescale becomes the stream time base after demuxing
+        cmd += ["-video_track_timescale", fmt.time_base[2:]]
+    cmd.append(str(dest))
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def _concat_ffmpeg(clips: List[Path], out: Path, log) -> str:
+    formats = [probe(p) for p in clips]
+    target  = _target_format(formats)
+    with tempfile.TemporaryDirectory(dir=out.parent, prefix=".assemble-") as tmp:
+        parts: List[Path] = []
+        reencoded = 0
+        for i, (clip, fmt) in enumerate(zip(clips, formats)):
+            if fmt == target:
+                parts.append(clip.resolve())
+            else:
+                norm = Path(tmp) / f"norm_{i}.mp4"
+                _normalize(clip, norm, target, fmt)
+                parts.append(norm)
+                reencoded += 1
+        if reencoded:
+            log(f"  Re-encoded {reencoded}/{len(clips)} clip(s) to match the rest.")
+
+        listing = Path(tmp) / "concat.txt"
+        listing.write_text(
+            "".join("file '{}'\n".format(str(p).replace("'", r"'\''")) for p in parts),
+            encoding="utf-8",
+        )
+        partial = Path(tmp) / "final.mp4"
+        subprocess.run(
+            [FFMPEG, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", str(listing),
+             "-c", "copy", "-movflags", "+faststart", str(partial)],
+            check=True, capture_output=True,
+        )
+        os.replace(partial, out)
+    return "ffmpeg stream copy" if not reencoded else "ffmpeg concat"
+
+
+def _concat_moviepy(clips: List[Path], out: Path) -> str:
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    loaded = [VideoFileClip(str(p)) for p in clips]
+    try:
+        final = concatenate_videoclips(loaded, method="compose")
+        final.write_videofile(str(out), fps=24, logger=None,
+                              ffmpeg_params=["-movflags", "+faststart"])
+    finally:
+        for c in loaded:
+            c.close()
+    return "moviepy"
+
+
+def assemble(clips: List[Path], out: Path, log) -> str:
+    """Concatenate clips into out; returns the name of the engine that was used."""
+    if FFMPEG and FFPROBE:
+        try:
+            return _concat_ffmpeg(clips, out, log)
+        except (subprocess.CalledProcessError, OSError, ValueError, StopIteration) as e:
+            detail = getattr(e, "stderr", None)
+            if isinstance(detail, bytes):
+                detail = detail.decode(errors="replace")
+            log(f"  ffmpeg assembly failed ({(detail or str(e)).strip()[:200]}); falling back to moviepy.")
+    # Decoding and compositing frames in Python is the heaviest CPU work in the pipeline
+    return cpu.run(_concat_moviepy, clips, out)
@@ -0,0 +1,205 @@
+"""
+pipeline/cache.py
+Small on-disk caches shared by the pipeline helpers.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+URI_CACHE_MEM_BYTES  = int(os.environ.get("URI_CACHE_MEM_MB", "64")) * 1024 * 1024
+URI_CACHE_DISK_BYTES = int(os.environ.get("URI_CACHE_DISK_MB", "256")) * 1024 * 1024
+
+
+def content_key(*parts: str) -> str:
+    """Stable sha256 over the given strings (NUL-separated so parts can't run together)."""
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_json(path: Path, default: Any = None) -> Any:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path: Path, data: Any):
+    """Write JSON next to the target and rename over it, so readers never see half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def trim_dir(d: Path, max_bytes: int, suffix: str):
+    """Delete the least recently modified `suffix` files in d until they total max_bytes or less."""
+    files = []
+    for e in os.scandir(d):
+        if e.name.endswith(suffix):
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, e.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, fpath in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(fpath)
+            total -= size
+        except OSError:
+            pass
+
+
+class JsonCache:
+    """
+    Size-bounded key → JSON value store persisted to a single file.
+    Least recently used entries are evicted once max_entries is exceeded.
+    Writes merge with the file under an flock, so concurrent jobs (in any
+    worker process) sharing it don't drop each other's entries.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 2000):
+        self.path        = path
+        self.max_entries = max_entries
+        self.hits        = 0
+        self.misses      = 0
+        self._lock       = threading.Lock()
+        data = read_json(path, {})
+        self._entries: dict = data if isinstance(data, dict) else {}
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["t"] = time.time()
+            return entry["v"]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: str, value: Any):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict):
+        """Store several entries with a single write of the file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path.with_name(self.path.name + ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            disk = read_json(self.path, {})
+            merged = disk if isinstance(disk, dict) else {}
+            for key, entry in self._entries.items():
+                if key not in merged or entry["t"] > merged[key].get("t", 0):
+                    merged[key] = entry
+            now = time.time()
+            for key, value in items.items():
+                merged[key] = {"v": value, "t": now}
+            if len(merged) > self.max_entries:
+                by_age = sorted(merged, key=lambda k: merged[k].get("t", 0))
+                for k in by_age[:len(merged) - self.max_entries]:
+                    del merged[k]
+            write_json_atomic(self.path, merged)
+            self._entries = merged
+
+
+class UriCache:
+    """
+    Encoded data-URI cache for reference images.
+    A process-wide in-memory LRU sits in front of a per-project directory of
+    .uri files, so repeat jobs on the same project skip decoding and resizing.
+    """
+
+    def __init__(self, max_mem_bytes: int = URI_CACHE_MEM_BYTES,
+                 max_disk_bytes: int = URI_CACHE_DISK_BYTES):
+        self.max_mem_bytes  = max_mem_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits      = 0
+        self.disk_hits = 0
+        self.misses    = 0
+        self._mem: "OrderedDict[str, str]" = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path: Path, max_side: int, quality: int) -> str:
+        st = path.stat()
+        return content_key(str(path.resolve()), str(st.st_mtime_ns), str(st.st_size),
+                           str(max_side), str(quality))
+
+    def get(self, key: str, disk_dir: Path) -> Optional[str]:
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+        f = disk_dir / f"{key}.uri"
+        try:
+            value = f.read_text(encoding="ascii")
+            os.utime(f)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str, disk_dir: Path):
+        with self._lock:
+            self._remember(key, value)
+        disk_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=disk_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(value)
+        os.replace(tmp, disk_dir / f"{key}.uri")
+        trim_dir(disk_dir, self.max_disk_bytes, ".uri")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "entries": len(self._mem), "bytes": self._mem_bytes}
+
+    def _remember(self, key: str, value: str):
+        if key in self._mem:
+            self._mem_bytes -= len(self._mem.pop(key))
+        self._mem[key] = value
+        self._mem_bytes += len(value)
+        while self._mem_bytes > self.max_mem_bytes and len(self._mem) > 1:
+            _, old = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old)
+
+
+URI_CACHE = UriCache()
@@ -0,0 +1,162 @@
+"""
+pipeline/compose.py
+CPU-bound page work: text overlays, title lettering and reference encoding.
+These run in the cpu.py process pool, so they take and return file paths and
+strings rather than images.
+"""
+import base64
+import io
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from . import text as text_layout
+
+OVERLAY_FONT  = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
+TITLE_FONTS   = [
+    "/usr/share/fonts/truetype/liberation/LiberationSans-BoldItalic.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+]
+PANEL_FILL    = (214, 186, 140, 205)
+PANEL_OUTLINE = (120, 90, 50, 200)
+TEXT_COLOR    = (45, 30, 15, 255)
+
+
+def data_uri(src: Path, max_side: int, quality: int) -> str:
+    """src downscaled to max_side as a base64 data URI: PNG if it has alpha, else JPEG."""
+    img = Image.open(src)
+    has_alpha = "A" in img.getbands()
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    w, h = img.size
+    scale = min(1.0, max_side / float(max(w, h)))
+    if scale < 1.0:
+        img = img.resize((max(1, int(w*scale)), max(1, int(h*scale))), Image.LANCZOS)
+    buf = io.BytesIO()
+    if has_alpha:
+        img.save(buf, "PNG", optimize=True)
+        mime = "image/png"
+    else:
+        img.save(buf, "JPEG", quality=quality, optimize=True)
+        mime = "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(buf.getvalue()).decode()}"
+
+
+def render_title(img_path: Path, title_text: str):
+    """Whimsical title: big bold outlined text, no box, rainbow stroke, centred."""
+    # Also normalise title page to portrait
+    TARGET_W, TARGET_H = 768, 1024
+    base = Image.open(img_path).convert("RGBA")
+    if base.size != (TARGET_W, TARGET_H):
+        base = base.resize((TARGET_W, TARGET_H), Image.LANCZOS)
+    w, h = base.size
+
+    # Pick biggest font that fits within 82% width
+    max_text_w = int(w * 0.82)
+
+    def title_fits(lay: text_layout.Layout):
+        ls = lay.wrap(title_text, max_text_w)
+        # Accept if all lines fit and total height < 45% of image
+        return ls if ls and (lay.line_h + 16) * len(ls) < h * 0.45 else None
+
+    best = text_layout.fit(range(int(w * 0.12), 30, -4), TITLE_FONTS, title_fits)
+    if best:
+        lay, best_lines = best
+    else:
+        lay, best_lines = text_layout.default_layout(), [title_text]
+    best_font = lay.font
+    line_h    = lay.line_h + 20
+
+    # Pin text block near the top of the image
+    y_start = int(h * 0.04)
+
+    # Rainbow palette cycling per line
+    rainbow = [
+        (255, 80,  80,  255),   # coral red
+        (255, 180,  30, 255),   # sunny yellow
+        (80,  210,  80, 255),   # lime green
+        (60,  160, 255, 255),   # sky blue
+        (200,  80, 255, 255),   # purple
+        (255, 120, 200, 255),   # pink
+    ]
+
+    overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    draw    = ImageDraw.Draw(overlay)
+
+    for li, line in enumerate(best_lines):
+        bbox = draw.textbbox((0, 0), line, font=best_font)
+        lw   = bbox[2] - bbox[0]
+        x    = (w - lw) // 2
+        y    = y_start + li * line_h
+        color = rainbow[li % len(rainbow)]
+
+        # Thick black outline: the line at every offset in a square, from one rasterization
+        outline_r = max(4, int(line_h * 0.09))
+        mask, (ox, oy) = text_layout.outline_mask(best_font, line, outline_r, 2)
+        overlay.paste((0, 0, 0, 220), (x + ox, y + oy), mask)
+
+        # Soft drop shadow
+        draw.text((x + 5, y + 6), line, font=best_font, fill=(0, 0, 0, 140))
+
+        # Main coloured text
+        draw.text((x, y), line, font=best_font, fill=color)
+
+    Image.alpha_composite(base, overlay).convert("RGB").save(img_path)
+
+
+def render_overlay(img_path: Path, text: str, position: str = "bottom"):
+    base = Image.open(img_path).convert("RGBA")
+    # ── FIX 2: normalise every page to portrait 768×1024 before overlay ──
+    TARGET_W, TARGET_H = 768, 1024
+    base = base.resize((TARGET_W, TARGET_H), Image.LANCZOS)
+    w, h = base.size
+
+    overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    draw    = ImageDraw.Draw(overlay)
+
+    # Auto-shrink font until text fits comfortably
+    margin   = int(w * 0.05)
+    pl, pr   = margin, w - margin
+    max_text_w = (pr - pl) - 40
+    max_panel_h = int(h * 0.38)   # never more than 38% of image height
+    padding  = 18
+
+    def panel_fits(lay: text_layout.Layout):
+        ls = lay.wrap(text, max_text_w)
+        return ls if max(1, len(ls)) * (lay.line_h + 6) + padding * 2 <= max_panel_h else None
+
+    best = text_layout.fit(range(44, 17, -3), [OVERLAY_FONT], panel_fits)
+    if best:
+        lay, lines = best
+    else:
+        lay = text_layout.default_layout()
+        lines = lay.wrap(text, max_text_w)
+    font    = lay.font
+    wrapped = "\n".join(lines)
+
+    line_h      = lay.line_h + 6
+    n_lines     = max(1, len(lines))
+    panel_h     = n_lines * line_h + padding * 2
+
+    # Always pin to bottom
+    panel_bottom = h - int(h * 0.012)
+    panel_top    = panel_bottom - panel_h
+
+    # Drop shadow then panel
+    shadow = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    ImageDraw.Draw(shadow).rounded_rectangle(
+        [(pl+5, panel_top+7), (pr+5, panel_bottom+7)],
+        radius=22, fill=(0, 0, 0, 90))
+    shadow  = shadow.filter(ImageFilter.GaussianBlur(6))
+    overlay = Image.alpha_composite(shadow, overlay)
+    draw    = ImageDraw.Draw(overlay)
+    draw.rounded_rectangle(
+        [(pl, panel_top), (pr, panel_bottom)],
+        radius=22, fill=PANEL_FILL, outline=PANEL_OUTLINE, width=4)
+
+    # Render wrapped text
+    draw.multiline_text(
+        (pl + 20, panel_top + padding),
+        wrapped, font=font, fill=TEXT_COLOR, spacing=6)
+
+    Image.alpha_composite(base, overlay).convert("RGB").save(img_path)
@@ -0,0 +1,83 @@
+"""
+pipeline/cpu.py
+Process pool for CPU-bound Pillow and codec work (page overlays, title pages,
+reference encoding, PDF pages, moviepy assembly, upload derivatives), so it
+runs across cores instead of holding the API process's GIL while requests
+wait. Work goes in as file paths and comes back as bytes, strings or small
+dicts; images are never pickled.
+
+    CPU_WORKERS=0 runs everything inline in the calling thread.
+"""
+import multiprocessing as mp
+import multiprocessing.util
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator
+
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process has threads (and locks) a fork would copy mid-use
+            _pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=mp.get_context("spawn"))
+            # When this process is itself a multiprocessing child (uvicorn --workers, the
+            # benchmark) it joins its children before atexit runs, so stop the pool first,
+            # ahead of the finalizers that close its queues
+            multiprocessing.util.Finalize(_pool, _pool.shutdown, exitpriority=100)
+        return _pool
+
+
+def _reset(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died (e.g. OOM-killed) so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def run(fn: Callable, *args) -> Any:
+    """fn(*args) in a worker process; fn must be a module-level function."""
+    if CPU_WORKERS <= 0:
+        return fn(*args)
+    p = pool()
+    try:
+        return p.submit(fn, *args).result()
+    except BrokenProcessPool:
+        _reset(p)
+        raise
+
+
+def imap(fn: Callable, items: Iterable[tuple]) -> Iterator[Any]:
+    """
+    fn(*item) for each item, yielded in order, with at most two per worker in
+    flight so results don't pile up in memory ahead of the consumer.
+    """
+    if CPU_WORKERS <= 0:
+        for item in items:
+            yield fn(*item)
+        return
+    p = pool()
+    window: deque = deque()
+    try:
+        for item in items:
+            window.append(p.submit(fn, *item))
+            if len(window) >= CPU_WORKERS * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    except BrokenProcessPool:
+        _reset(p)
+        raise
+    finally:
+        for fut in window:
+            fut.cancel()
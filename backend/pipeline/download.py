@@ -0,0 +1,94 @@
+"""
+pipeline/download.py
+Streaming asset downloads over a shared, pooled HTTP session.
+Files are written in chunks to a temp file next to the destination and renamed
+into place, resuming with an HTTP Range request if the connection drops.
+Transfers ask for identity encoding so bytes received are bytes on the wire,
+which is what Content-Length and Range count.
+"""
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DOWNLOAD_TIMEOUT   = (10, 180)     # (connect, read) seconds
+DOWNLOAD_CHUNK     = 256 * 1024
+DOWNLOAD_RETRIES   = 3
+DOWNLOAD_POOL_SIZE = int(os.environ.get("DOWNLOAD_POOL_SIZE", "32"))
+FILE_MODE          = 0o644
+
+_umask = os.umask(0)        # mkstemp creates 0600; downloads get the usual mode instead
+os.umask(_umask)
+
+_session = None
+_session_lock = threading.Lock()
+
+_RESUMABLE = (requests.ConnectionError, requests.Timeout,
+              requests.exceptions.ChunkedEncodingError)
+
+
+def session() -> requests.Session:
+    """Process-wide session so connections to the asset CDN are reused across jobs."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=DOWNLOAD_POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def fetch(url: str, dest: Path) -> dict:
+    """Download url to dest. Returns {"bytes", "seconds", "resumes"}."""
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".part")
+    os.close(fd)
+    start    = time.monotonic()
+    received = 0
+    resumes  = 0
+    try:
+        while True:
+            headers = {"Accept-Encoding": "identity"}
+            if received:
+                headers["Range"] = f"bytes={received}-"
+            encoded = False
+            try:
+                with session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers) as r:
+                    if received and r.status_code == 416:
+                        break                       # nothing left to send
+                    r.raise_for_status()
+                    # Compressed anyway: decoded bytes can't be checked or resumed from
+                    encoded = r.headers.get("Content-Encoding", "identity") != "identity"
+                    if received and (r.status_code != 206 or encoded):
+                        received = 0                # server ignored Range; start over
+                    expected = r.headers.get("Content-Length")
+                    expected = received + int(expected) if expected and not encoded else None
+                    with open(tmp, "ab" if received else "wb") as f:
+                        for chunk in r.iter_content(DOWNLOAD_CHUNK):
+                            f.write(chunk)
+                            received += len(chunk)
+                    if expected is not None and received < expected:
+                        raise requests.ConnectionError(
+                            f"connection closed after {received} of {expected} bytes")
+                break
+            except _RESUMABLE:
+                if resumes >= DOWNLOAD_RETRIES:
+                    raise
+                resumes += 1
+                if encoded:
+                    received = 0
+                time.sleep(min(2 ** resumes, 10))
+        os.chmod(tmp, FILE_MODE & ~_umask)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return {"bytes": received, "seconds": time.monotonic() - start, "resumes": resumes}
@@ -0,0 +1,216 @@
+"""
+pipeline/fake_xai.py
+Offline stand-in for the xAI client, for benchmarks and local runs without
+network or spend. It implements the surface the pipeline uses (image.sample,
+chat.create → append/sample, video.generate) with configurable latency,
+jitter and error rate, and hands back URLs to PNG/MP4 fixtures served by a
+local HTTP server, so downloads, overlays, PDF and assembly all run for real.
+
+    XAI_BACKEND=fake  FAKE_XAI_LATENCY=1.0  FAKE_XAI_JITTER=0.3  FAKE_XAI_ERROR_RATE=0.02
+"""
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from PIL import Image, ImageDraw, ImageFilter
+
+FIXTURE_VARIANTS = 4          # distinct images served in rotation
+FIXTURE_SIZE     = (768, 1024)
+VIDEO_SECONDS    = 2
+
+
+@dataclass
+class FakeConfig:
+    # Mean seconds per call, before `latency` scaling
+    image_seconds: float = 6.0
+    chat_seconds:  float = 1.5
+    video_seconds: float = 30.0
+    latency:    float = float(os.environ.get("FAKE_XAI_LATENCY", "1.0"))     # multiplier
+    jitter:     float = float(os.environ.get("FAKE_XAI_JITTER", "0.3"))      # ± fraction
+    error_rate: float = float(os.environ.get("FAKE_XAI_ERROR_RATE", "0"))
+    seed: Optional[int] = None
+    calls: Dict[str, int] = field(default_factory=dict)
+
+
+class FakeAPIError(Exception):
+    """Shaped like a gRPC error so the rate governor classifies it the same way."""
+
+    def __init__(self, code: str, msg: str):
+        super().__init__(msg)
+        self._code = SimpleNamespace(name=code)
+
+    def code(self):
+        return self._code
+
+
+# ── Fixture server ───────────────────────────────────────────────────────────
+def _png(i: int) -> bytes:
+    noise = Image.effect_noise(FIXTURE_SIZE, 40 + 10 * i)
+    img = Image.merge("RGB", [noise.point(lambda v, k=k: (v + 60 * k + 40 * i) % 256) for k in range(3)])
+    img = img.filter(ImageFilter.GaussianBlur(4))
+    ImageDraw.Draw(img).ellipse([(200, 300), (560, 760)], fill=(240, 200, 120))
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _ffmpeg() -> Optional[str]:
+    exe = shutil.which("ffmpeg")
+    if exe:
+        return exe
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def _mp4() -> bytes:
+    """A short 720p clip with silent audio, or placeholder bytes without ffmpeg."""
+    exe = _ffmpeg()
+    if not exe:
+        return b"\x00\x00\x00\x18ftypmp42" + bytes(1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "clip.mp4")
+        subprocess.run(
+            [exe, "-y", "-v", "error",
+             "-f", "lavfi", "-i", f"testsrc=duration={VIDEO_SECONDS}:size=1280x720:rate=24",
+             "-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100",
+             "-shortest", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+             "-c:a", "aac", out],
+            check=True,
+        )
+        with open(out, "rb") as f:
+            return f.read()
+
+
+class FixtureServer:
+    """Serves /img/<n>.png and /vid/<n>.mp4 from memory on a loopback port."""
+
+    def __init__(self):
+        self.files = {f"/img/{i}.png": _png(i) for i in range(FIXTURE_VARIANTS)}
+        self.files["/vid/0.mp4"] = _mp4()
+        files = self.files
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = files.get(self.path.split("?")[0])
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, name="fake-xai-fixtures", daemon=True).start()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def fixture_server() -> FixtureServer:
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = FixtureServer()
+        return _server
+
+
+# ── Client ───────────────────────────────────────────────────────────────────
+class _Endpoint:
+    def __init__(self, owner: "FakeClient"):
+        self.owner = owner
+
+
+class _Images(_Endpoint):
+    def sample(self, prompt: str, model: str, image_urls=None, **_):
+        n = self.owner._call("image", self.owner.config.image_seconds)
+        return SimpleNamespace(url=f"{self.owner.server.base}/img/{n % FIXTURE_VARIANTS}.png?n={n}")
+
+
+class _Videos(_Endpoint):
+    def generate(self, prompt: str, image_url: str, model: str, **_):
+        n = self.owner._call("video", self.owner.config.video_seconds)
+        return SimpleNamespace(url=f"{self.owner.server.base}/vid/0.mp4?n={n}")
+
+
+class _Chat:
+    def __init__(self, owner: "FakeClient", response_format=None):
+        self.owner = owner
+        self.json  = response_format == "json_object"
+        self.messages = []
+
+    def append(self, message):
+        self.messages.append(message)
+
+    def sample(self):
+        self.owner._call("chat", self.owner.config.chat_seconds)
+        text = _text(self.messages[-1]) if self.messages else ""
+        if self.json:
+            m = re.search(r"Entries: (\{.*\})", text, re.S)
+            items = json.loads(m.group(1)) if m else {}
+            return SimpleNamespace(content=json.dumps({k: _retell(v) for k, v in items.items()}))
+        m = re.search(r"Original: '(.*)'", text, re.S)
+        return SimpleNamespace(content=_retell(m.group(1) if m else text))
+
+
+class _Chats(_Endpoint):
+    def create(self, model: str, response_format=None, **_):
+        return _Chat(self.owner, response_format)
+
+
+def _text(message) -> str:
+    """Plain text of a chat message: an xai_sdk proto, or the fallback string."""
+    content = getattr(message, "content", None)
+    if content is not None:
+        return "".join(getattr(c, "text", "") for c in content)
+    return str(message)
+
+
+def _retell(text: str) -> str:
+    words = text.split()[:24]
+    return f"Look! {' '.join(words)}. What a fun day!"
+
+
+class FakeClient:
+    """Drop-in for xai_sdk.Client(api_key=...) as far as the pipeline is concerned."""
+
+    def __init__(self, api_key: str = "", config: Optional[FakeConfig] = None):
+        self.config = config or FakeConfig()
+        self.server = fixture_server()
+        self.image  = _Images(self)
+        self.video  = _Videos(self)
+        self.chat   = _Chats(self)
+        self._rng   = random.Random(self.config.seed)
+        self._lock  = threading.Lock()
+
+    def _call(self, kind: str, seconds: float) -> int:
+        cfg = self.config
+        with self._lock:
+            n = cfg.calls[kind] = cfg.calls.get(kind, 0) + 1
+            delay = seconds * cfg.latency * (1 + self._rng.uniform(-cfg.jitter, cfg.jitter))
+            fail  = self._rng.random() < cfg.error_rate
+            code  = self._rng.choice(["RESOURCE_EXHAUSTED", "UNAVAILABLE"])
+        time.sleep(max(0.0, delay))
+        if fail:
+            raise FakeAPIError(code, f"fake {kind} error ({code})")
+        return n
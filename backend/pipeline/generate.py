@@ -5,16 +5,28 @@ Three entry points:
   run_regen_page(...)  — regenerate a single page image
   run_finalize(...)    — build PDF + videos from approved images
 """
-import base64
-import io
 import json
-import time
+import os
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Optional, List, Dict
 
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from . import artifacts
+from . import compose
+from . import cpu
+from . import download as dl
+from . import ingest
+from . import metrics
+from .assemble import assemble
+from . import thumbs
+from .jobs import JobCancelled, JobStore
+from .pdf import DEFAULT_PDF_PROFILE, write_pdf
+from .ratelimit import GOVERNOR, CircuitOpen
+from .singleflight import IN_FLIGHT
+from .cache import (URI_CACHE, JsonCache, UriCache, content_key, file_digest, read_json,
+                    trim_dir, write_json_atomic)
 
 try:
     from xai_sdk import Client
@@ -23,19 +35,211 @@ try:
 except ImportError:
     XAI_AVAILABLE = False
 
-MAX_INPUT_IMAGES  = 3
-REF_MAX_SIDE_CHAR = 512
-REF_MAX_SIDE_LOC  = 1024
-JPEG_QUALITY_LOC  = 70
-GROK_RETRIES      = 2
-GROK_RETRY_SLEEP  = 2
+    def user(text: str):            # enough for the fake backend's chat
+        return f"user: {text}"
+
+    def system(text: str):
+        return f"system: {text}"
+
+# "xai" talks to the real API; "fake" uses the offline stand-in in fake_xai.py
+XAI_BACKEND = os.environ.get("XAI_BACKEND", "xai")
+
+
+def make_client(api_key: str):
+    """The API client a job uses. The pipeline only needs image, chat and video."""
+    if XAI_BACKEND == "fake":
+        from .fake_xai import FakeClient
+        return FakeClient(api_key)
+    if not XAI_AVAILABLE:
+        raise RuntimeError("xai_sdk not installed.")
+    return Client(api_key=api_key)
+
+
+MAX_INPUT_IMAGES    = 3
+REF_MAX_SIDE_CHAR   = 512
+REF_MAX_SIDE_LOC    = 1024
+JPEG_QUALITY_LOC    = 70
+MAX_PARALLEL_PAGES  = int(os.environ.get("MAX_PARALLEL_PAGES", "4"))
+MAX_PARALLEL_VIDEOS = int(os.environ.get("MAX_PARALLEL_VIDEOS", "4"))
+REWRITE_MODEL       = "grok-4"
+REWRITE_SYSTEM      = "You are a cheerful editor making stories perfect for 4-6 year olds."
+REWRITE_CACHE_MAX   = 2000
+PLATE_CACHE_BYTES   = int(os.environ.get("PLATE_CACHE_MB", "512")) * 1024 * 1024   # per project
+REWRITE_BATCH_ITEMS = 20      # texts per structured batch call
+IMAGE_MODEL         = "grok-imagine-image"
+# Manifest keys that don't affect how any page image looks
+IMAGE_KEY_IGNORED   = ("api_key", "pages", "title", "max_parallel_pages", "max_parallel_videos",
+                       "pdf_profile")
+
+VIDEO_MODEL         = "grok-imagine-video"
+VIDEO_ASPECT        = "16:9"
+VIDEO_RESOLUTION    = "720p"
+
+_narrations_lock = threading.Lock()
+_images_lock     = threading.Lock()
+
+
+def _load_narrations(proj: Path) -> Dict[str, str]:
+    """Narration text that was actually rendered onto each page, keyed by page index."""
+    return read_json(proj / "narrations.json", {}) or {}
+
+
+def _record_narration(proj: Path, page_index: int, narration: str):
+    with _narrations_lock:
+        data = _load_narrations(proj)
+        data[str(page_index)] = narration
+        write_json_atomic(proj / "narrations.json", data)
+
+
+def _load_build_record(proj: Path) -> dict:
+    """
+    What the last finalize produced: a content key per page video plus keys for
+    the PDF and the assembled movie, so a re-finalize only rebuilds what changed.
+    """
+    record = read_json(proj / "build.json", {}) or {}
+    record.setdefault("videos", {})
+    return record
+
+
+def _load_image_record(proj: Path) -> dict:
+    """
+    Checkpoint of the image phase: the input key each finished image was made
+    from (0 = title page), so a resumed run only redoes missing or stale pages.
+    """
+    record = read_json(proj / "images.json", {}) or {}
+    record.setdefault("pages", {})
+    return record
+
+
+def _mark_image(proj: Path, page_index: int, key: Optional[str]):
+    """Record page_index as built from `key`, or as not (reliably) built when key is None."""
+    with _images_lock:
+        record = _load_image_record(proj)
+        if key is None:
+            record["pages"].pop(str(page_index), None)
+        else:
+            record["pages"][str(page_index)] = key
+        write_json_atomic(proj / "images.json", record)
+
+
+def _image_keys(proj: Path, manifest: dict) -> Dict[int, str]:
+    """
+    Input key per image: its page (or title) spec, every book-wide setting, and
+    the size and mtime of each reference file it may read.
+    """
+    def stamp(rel: Optional[str]) -> str:
+        try:
+            st = (proj / rel).stat()
+            return f"{rel}:{st.st_mtime_ns}:{st.st_size}"
+        except (OSError, TypeError):
+            return f"{rel}:missing"
+
+    assets = manifest.get("assets", {})
+    files  = [c.get("path") for c in assets.get("characters", {}).values()]
+    for loc in assets.get("locations", {}).values():
+        files += [loc.get("plate")] + list(loc.get("refs", []))
+    book   = {k: v for k, v in manifest.items() if k not in IMAGE_KEY_IGNORED}
+    shared = content_key(json.dumps(book, sort_keys=True), IMAGE_MODEL, REWRITE_MODEL,
+                         *(stamp(f) for f in files if f))
+
+    keys: Dict[int, str] = {}
+    title = manifest.get("title")
+    if title:
+        keys[0] = content_key(shared, json.dumps(title, sort_keys=True), stamp(title.get("base_image")))
+    for i, page in enumerate(manifest.get("pages", [])):
+        keys[i + 1] = content_key(shared, json.dumps(page, sort_keys=True), stamp(page.get("base_image")))
+    return keys
+
+
+def _parallelism(manifest: dict, key: str, default: int) -> int:
+    """Worker count from the manifest, falling back to the env/module default."""
+    try:
+        n = int(manifest.get(key) or default)
+    except (TypeError, ValueError):
+        n = default
+    return max(1, n)
+
+
+def _run_parallel(tasks: List[tuple], workers: int, on_done, name: str = "worker"):
+    """
+    Run (label, fn) tasks on a bounded thread pool and call on_done(label, result)
+    as each one finishes. The first failure cancels everything not yet started
+    and is re-raised once the in-flight tasks have returned.
+    """
+    if not tasks:
+        return
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(tasks)), thread_name_prefix=name)
+    try:
+        futures = {pool.submit(metrics.carry(fn)): label for label, fn in tasks}
+        for fut in as_completed(futures):
+            on_done(futures[fut], fut.result())
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+
+def _job_logger(jobs: JobStore, job_id: str):
+    def log(msg: str, progress: int = None):
+        print(f"[{job_id}] {msg}", flush=True)
+        jobs.append_log(job_id, msg, progress)
+    return log
+
+
+def _ready_entry(proj: Path, page_index: int, phase: Optional[str] = None) -> dict:
+    """
+    A finished page image, as reported to clients watching the job (0 = title page).
+    `phase` just (re)wrote it: index it and drop its stale thumbnails. Without one
+    it is unchanged since an earlier run and keeps its indexed version.
+    """
+    name  = "title_page.png" if page_index == 0 else f"page_{page_index}.png"
+    rel   = f"generated_images/{name}"
+    index = artifacts.index_for(proj)
+    v = None if phase else index.current_version(proj.name, rel, (proj / rel).stat())
+    if v is None:
+        if phase:
+            thumbs.invalidate(proj, rel)
+        v = artifacts.version(index.record(proj.name, proj, rel, phase or "images"))
+    return {"page": page_index, "path": rel, "v": v}
+
+
+def _record_artifact(proj: Path, rel: str, phase: str, sha256: Optional[str] = None):
+    artifacts.index_for(proj).record(proj.name, proj, rel, phase, sha256)
+
+
+def _save_trace(proj: Path, jobs: JobStore, job_id: str, rec: metrics.Recorder, trace: bool):
+    """Write the job's spans to traces/<job_id>.json (Chrome trace format) when asked to."""
+    if not trace:
+        return
+    rel = f"traces/{job_id}.json"
+    try:
+        (proj / "traces").mkdir(exist_ok=True)
+        write_json_atomic(proj / rel, rec.chrome_trace())
+        _record_artifact(proj, rel, "trace")
+    except OSError as e:
+        jobs.append_log(job_id, f"Trace not saved: {e}")
+        return
+    jobs.append_log(job_id, f"Trace saved to {rel} (open it in ui.perfetto.dev).")
+    jobs.update(job_id, trace=rel)
+
+
+def _cancel_job(jobs: JobStore, job_id: str):
+    jobs.append_log(job_id, "Cancelled.")
+    jobs.update(job_id, status="cancelled")
+
+
+def _fail_job(jobs: JobStore, job_id: str, e: Exception):
+    # Log before flipping status so watchers that stop at a final status see every line
+    jobs.append_log(job_id, f"FATAL: {e}")
+    jobs.append_log(job_id, traceback.format_exc())
+    jobs.update(job_id, status="error", error=str(e))
 
 
 # ─────────────────────────────────────────────────────────────────
 # SHARED HELPERS
 # ─────────────────────────────────────────────────────────────────
 
-def _build_helpers(client, proj: Path, manifest: dict, log):
+def _build_helpers(client, proj: Path, manifest: dict, log, checkpoint=lambda: None):
     assets     = manifest.get("assets", {})
     char_descs = manifest.get("character_descriptions", {})
     theme        = manifest.get("theme", "light")
@@ -55,56 +259,119 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
             " inviting daytime atmosphere. Friendly and uplifting mood."
         )
 
-    panel_fill    = (214, 186, 140, 205)
-    panel_outline = (120, 90, 50, 200)
-    text_color    = (45, 30, 15, 255)
+    uri_dir   = proj / ".cache" / "uri"
+    uri_stats = {"hits": 0, "misses": 0}        # this job's lookups; URI_CACHE counts the process's
+    uri_lock  = threading.Lock()
 
     def encode_uri(path: Path, max_side: int, quality: int = 75) -> Optional[str]:
         if not path.exists():
             log(f"  Warning: not found -> {path}")
             return None
-        img = Image.open(path)
-        has_alpha = "A" in img.getbands()
-        img = img.convert("RGBA" if has_alpha else "RGB")
-        w, h = img.size
-        scale = min(1.0, max_side / float(max(w, h)))
-        if scale < 1.0:
-            img = img.resize((max(1, int(w*scale)), max(1, int(h*scale))), Image.LANCZOS)
-        buf = io.BytesIO()
-        if has_alpha:
-            img.save(buf, "PNG", optimize=True)
-            mime = "image/png"
-        else:
-            img.save(buf, "JPEG", quality=quality, optimize=True)
-            mime = "image/jpeg"
-        return f"data:{mime};base64,{base64.b64encode(buf.getvalue()).decode()}"
-
+        key = UriCache.key(path, max_side, quality)
+        cached = URI_CACHE.get(key, uri_dir)
+        with uri_lock:
+            uri_stats["misses" if cached is None else "hits"] += 1
+        metrics.CACHE_LOOKUPS.inc(cache="uri", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+        with metrics.span("encode_uri"):
+            # Uploaded references have downscaled copies prepared at ingest
+            uri = cpu.run(compose.data_uri, ingest.best_source(proj, path, max_side), max_side, quality)
+        URI_CACHE.put(key, uri, uri_dir)
+        return uri
+
+    # In-flight calls are shared per API key, so one account never pays for another's
+    account   = content_key(manifest.get("api_key", ""))
+    api_usage: Dict[str, float] = {}
+
+    def api(kind: str, model: str, fn):
+        """Every xAI request goes through the shared governor (rate limits, retries, breaker)."""
+        return GOVERNOR.call(kind, model, account, fn, checkpoint, api_usage)
+
+    @metrics.timed("grok_image")
     def grok_image(prompt: str, image_urls: List[str]):
-        last = None
-        for attempt in range(GROK_RETRIES + 1):
-            try:
-                return client.image.sample(
-                    prompt=prompt, model="grok-imagine-image",
-                    image_urls=image_urls if image_urls else None,
-                )
-            except Exception as e:
-                last = e
-                if attempt < GROK_RETRIES:
-                    time.sleep(GROK_RETRY_SLEEP)
-        raise last
+        def call():
+            return api("image", IMAGE_MODEL, lambda: client.image.sample(
+                prompt=prompt, model=IMAGE_MODEL,
+                image_urls=image_urls if image_urls else None,
+            ))
+        return IN_FLIGHT.do(content_key("image", account, prompt, *image_urls), call)
 
-    def rewrite(text: str) -> str:
-        if not text:
-            return text
-        chat = client.chat.create(model="grok-4")
-        chat.append(system("You are a cheerful editor making stories perfect for 4-6 year olds."))
-        chat.append(user(
+    rewrite_cache = JsonCache(proj / ".cache" / "rewrite.json", REWRITE_CACHE_MAX)
+
+    def rewrite_prompt(text: str) -> str:
+        return (
             f"Rewrite this as narration for a kindergarten children's book page. "
             f"Use very simple words, short sentences, make it fun and exciting. "
             f"Fix grammar, spelling, punctuation. Make it exactly 2 to 3 full sentences. "
             f"Original: '{text}'"
-        ))
-        return chat.sample().content.strip()
+        )
+
+    def rewrite_key(text: str) -> str:
+        return content_key(REWRITE_MODEL, REWRITE_SYSTEM, rewrite_prompt(text))
+
+    def rewrite(text: str) -> str:
+        if not text:
+            return text
+        prompt = rewrite_prompt(text)
+        key    = rewrite_key(text)
+        cached = rewrite_cache.get(key)
+        metrics.CACHE_LOOKUPS.inc(cache="rewrite", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        @metrics.timed("rewrite")
+        def call():
+            chat = client.chat.create(model=REWRITE_MODEL)
+            chat.append(system(REWRITE_SYSTEM))
+            chat.append(user(prompt))
+            out = api("chat", REWRITE_MODEL, chat.sample).content.strip()
+            rewrite_cache.put(key, out)
+            return out
+        return IN_FLIGHT.do(content_key("chat", account, key), call)
+
+    def rewrite_batch(texts: List[str]) -> dict:
+        """
+        Rewrite a whole manuscript in a few structured-JSON chat calls, filling
+        rewrite_cache so the per-item rewrite() calls that follow are hits. Entries a
+        batch drops or garbles are left for rewrite() to do one at a time.
+        """
+        todo   = list(dict.fromkeys(t for t in texts if t and rewrite_key(t) not in rewrite_cache))
+        chunks = [todo[i:i + REWRITE_BATCH_ITEMS] for i in range(0, len(todo), REWRITE_BATCH_ITEMS)]
+
+        @metrics.timed("rewrite_batch")
+        def run(chunk: List[str]) -> int:
+            items = {str(i): t for i, t in enumerate(chunk)}
+            try:
+                chat = client.chat.create(model=REWRITE_MODEL, response_format="json_object")
+                chat.append(system(REWRITE_SYSTEM))
+                chat.append(user(
+                    "These are the texts of one kindergarten children's book. Rewrite each entry as "
+                    "narration for its page. Use very simple words, short sentences, make it fun and "
+                    "exciting. Fix grammar, spelling, punctuation. Make each exactly 2 to 3 full "
+                    "sentences, and keep one consistent voice across the whole book. Reply with only "
+                    'a JSON object mapping every id to its rewritten text, like {"0": "..."}. '
+                    f"Entries: {json.dumps(items, ensure_ascii=False)}"
+                ))
+                out = json.loads(api("chat", REWRITE_MODEL, chat.sample).content)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                log(f"  Batch rewrite failed ({e}); rewriting those {len(chunk)} one by one.")
+                return 0
+            if not isinstance(out, dict):
+                return 0
+            found = {rewrite_key(t): out[i].strip() for i, t in items.items()
+                     if isinstance(out.get(i), str) and out[i].strip()}
+            rewrite_cache.put_many(found)
+            return len(found)
+
+        done = 0
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), 4),
+                                    thread_name_prefix="rewrite-batch") as pool:
+                done = sum(f.result() for f in [pool.submit(metrics.carry(run), c) for c in chunks])
+        return {"texts": len(todo), "rewritten": done, "calls": len(chunks)}
 
     def no_text_block() -> str:
         return (
@@ -158,193 +425,59 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
                 best_score, best_id = score, loc_id
         return best_id if best_score > 0 else None
 
+    @metrics.timed("download")
     def download(url: str, dest: Path):
-        data = requests.get(url, timeout=180).content
-        with open(dest, "wb") as f:
-            f.write(data)
-
-    def wrap_text(draw, text, font, max_w):
-        words = text.split()
-        lines, cur = [], []
-        for w in words:
-            cur.append(w)
-            if draw.textbbox((0, 0), " ".join(cur), font=font)[2] > max_w:
-                cur.pop()
-                if cur:
-                    lines.append(" ".join(cur))
-                cur = [w]
-        if cur:
-            lines.append(" ".join(cur))
-        return "\n".join(lines)
+        checkpoint()
+        st = dl.fetch(url, dest)
+        metrics.DOWNLOAD_BYTES.inc(st["bytes"])
+        resumed = f", {st['resumes']} resume(s)" if st["resumes"] else ""
+        log(f"  Downloaded {dest.name}: {st['bytes'] / 1024:.0f} KiB in {st['seconds']:.1f}s{resumed}")
 
+    @metrics.timed("render_title")
     def render_title(img_path: Path, title_text: str):
-        """Whimsical title: big bold outlined text, no box, rainbow stroke, centred."""
-        import math
-        # Also normalise title page to portrait
-        TARGET_W, TARGET_H = 768, 1024
-        base = Image.open(img_path).convert("RGBA")
-        if base.size != (TARGET_W, TARGET_H):
-            base = base.resize((TARGET_W, TARGET_H), Image.LANCZOS)
-        w, h = base.size
-
-        # Pick biggest font that fits within 82% width
-        font_paths = [
-            "/usr/share/fonts/truetype/liberation/LiberationSans-BoldItalic.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        ]
-        max_text_w = int(w * 0.82)
-        words      = title_text.split()
-
-        def wrap(draw, text, font, max_w):
-            words_ = text.split()
-            lines_, cur_ = [], []
-            for wd in words_:
-                cur_.append(wd)
-                if draw.textbbox((0,0)," ".join(cur_),font=font)[2] > max_w:
-                    cur_.pop()
-                    if cur_: lines_.append(" ".join(cur_))
-                    cur_ = [wd]
-            if cur_: lines_.append(" ".join(cur_))
-            return lines_
-
-        best_font  = None
-        best_lines = [title_text]
-        for font_size in range(int(w * 0.12), 30, -4):
-            for fp in font_paths:
-                try:
-                    f = ImageFont.truetype(fp, font_size)
-                    tmp = Image.new("RGBA", (w, h))
-                    d   = ImageDraw.Draw(tmp)
-                    ls  = wrap(d, title_text, f, max_text_w)
-                    # Accept if all lines fit and total height < 45% of image
-                    lh  = d.textbbox((0,0),"Ag",font=f)[3] + 16
-                    if ls and lh * len(ls) < h * 0.45:
-                        best_font  = f
-                        best_lines = ls
-                        break
-                except Exception:
-                    continue
-            if best_font:
-                break
-        if not best_font:
-            best_font  = ImageFont.load_default()
-            best_lines = [title_text]
-
-        dummy  = ImageDraw.Draw(Image.new("RGBA", (w, h)))
-        line_h = dummy.textbbox((0, 0), "Ag", font=best_font)[3] + 20
-        total_h = line_h * len(best_lines)
-
-        # Pin text block near the top of the image
-        y_start = int(h * 0.04)
-
-        # Rainbow palette cycling per line
-        rainbow = [
-            (255, 80,  80,  255),   # coral red
-            (255, 180,  30, 255),   # sunny yellow
-            (80,  210,  80, 255),   # lime green
-            (60,  160, 255, 255),   # sky blue
-            (200,  80, 255, 255),   # purple
-            (255, 120, 200, 255),   # pink
-        ]
-
-        overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-        draw    = ImageDraw.Draw(overlay)
-
-        for li, line in enumerate(best_lines):
-            bbox = draw.textbbox((0, 0), line, font=best_font)
-            lw   = bbox[2] - bbox[0]
-            x    = (w - lw) // 2
-            y    = y_start + li * line_h
-            color = rainbow[li % len(rainbow)]
-
-            # Thick black outline (draw text at offsets in all 8 directions)
-            outline_r = max(4, int(line_h * 0.09))
-            for dx in range(-outline_r, outline_r + 1, 2):
-                for dy in range(-outline_r, outline_r + 1, 2):
-                    if dx == 0 and dy == 0:
-                        continue
-                    draw.text((x + dx, y + dy), line, font=best_font,
-                               fill=(0, 0, 0, 220))
-
-            # Soft drop shadow
-            draw.text((x + 5, y + 6), line, font=best_font, fill=(0, 0, 0, 140))
-
-            # Main coloured text
-            draw.text((x, y), line, font=best_font, fill=color)
-
-        Image.alpha_composite(base, overlay).convert("RGB").save(img_path)
-
-    def render_overlay(img_path: Path, text: str, position: str = "bottom"):
-        base = Image.open(img_path).convert("RGBA")
-        # ── FIX 2: normalise every page to portrait 768×1024 before overlay ──
-        TARGET_W, TARGET_H = 768, 1024
-        base = base.resize((TARGET_W, TARGET_H), Image.LANCZOS)
-        w, h = base.size
-
-        overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-        draw    = ImageDraw.Draw(overlay)
-
-        # Auto-shrink font until text fits comfortably
-        margin   = int(w * 0.05)
-        pl, pr   = margin, w - margin
-        max_text_w = (pr - pl) - 40
-        max_panel_h = int(h * 0.38)   # never more than 38% of image height
-        padding  = 18
-
-        font_size = 44
-        font      = None
-        font_path = "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-        while font_size >= 18:
-            try:
-                f = ImageFont.truetype(font_path, font_size)
-            except Exception:
-                f = ImageFont.load_default()
-            wrapped   = wrap_text(draw, text, f, max_text_w)
-            line_h    = draw.textbbox((0, 0), "Ag", font=f)[3] + 6
-            n_lines   = len(wrapped.split("\n"))
-            total_txt_h = n_lines * line_h + padding * 2
-            if total_txt_h <= max_panel_h:
-                font = f
-                break
-            font_size -= 3
-        if font is None:
-            font    = ImageFont.load_default()
-            wrapped = wrap_text(draw, text, font, max_text_w)
-
-        line_h      = draw.textbbox((0, 0), "Ag", font=font)[3] + 6
-        n_lines     = len(wrapped.split("\n"))
-        panel_h     = n_lines * line_h + padding * 2
-
-        # Always pin to bottom
-        panel_bottom = h - int(h * 0.012)
-        panel_top    = panel_bottom - panel_h
-
-        # Drop shadow then panel
-        shadow = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-        ImageDraw.Draw(shadow).rounded_rectangle(
-            [(pl+5, panel_top+7), (pr+5, panel_bottom+7)],
-            radius=22, fill=(0, 0, 0, 90))
-        shadow  = shadow.filter(ImageFilter.GaussianBlur(6))
-        overlay = Image.alpha_composite(shadow, overlay)
-        draw    = ImageDraw.Draw(overlay)
-        draw.rounded_rectangle(
-            [(pl, panel_top), (pr, panel_bottom)],
-            radius=22, fill=panel_fill, outline=panel_outline, width=4)
-
-        # Render wrapped text
-        draw.multiline_text(
-            (pl + 20, panel_top + padding),
-            wrapped, font=font, fill=text_color, spacing=6)
-
-        Image.alpha_composite(base, overlay).convert("RGB").save(img_path)
+        cpu.run(compose.render_title, img_path, title_text)
+
+    @metrics.timed("render_overlay")
+    def render_overlay(img_path: Path, text: str):
+        cpu.run(compose.render_overlay, img_path, text)
 
     # Pre-encode character refs
     char_refs: Dict[str, Optional[str]] = {}
     for cid, cdata in assets.get("characters", {}).items():
         char_refs[cid] = encode_uri(proj / cdata["path"], REF_MAX_SIDE_CHAR)
 
-    def build_page_image(page: dict, img_path: Path, page_index: int):
+    # Environment plates, shared by pages (and runs) that ask for the same background
+    plate_dir   = proj / ".cache" / "plates"
+    plate_stats = {"reused": 0, "generated": 0}
+    plate_lock  = threading.Lock()
+
+    def env_plate(env_prompt: str, env_refs: List[str], loc: Optional[str], refresh: bool) -> Path:
+        plate = plate_dir / f"{content_key(IMAGE_MODEL, loc or '', env_prompt, *env_refs)}.png"
+        fresh = False
+
+        def make():
+            nonlocal fresh
+            if not refresh:
+                try:
+                    os.utime(plate)         # recently used, so trimming keeps it
+                    return
+                except FileNotFoundError:
+                    pass
+            plate_dir.mkdir(parents=True, exist_ok=True)
+            resp = grok_image(env_prompt, env_refs)
+            download(resp.url, plate)
+            fresh = True
+            # Refreshes and prompt edits leave old plates behind; drop the least recently used
+            trim_dir(plate_dir, PLATE_CACHE_BYTES, ".png")
+
+        # Pages needing the same plate at the same time wait for one generation
+        IN_FLIGHT.do(content_key("plate", str(plate)), make)
+        with plate_lock:
+            plate_stats["generated" if fresh else "reused"] += 1
+        metrics.CACHE_LOOKUPS.inc(cache="plate", result="miss" if fresh else "hit")
+        return plate
+
+    def build_page_image(page: dict, img_path: Path, page_index: int, refresh_background: bool = False):
         """Generate image for one page and save with text overlay."""
         desc      = rewrite(page.get("raw_description", "")) or page.get("raw_description", "")
         narration = rewrite(page.get("raw_narration_text", "")) or page.get("raw_narration_text", "")
@@ -360,7 +493,6 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
             base_image = loc_data.get("plate") or (loc_data.get("refs", [None])[0])
 
         if not base_image:
-            env_path  = proj / "generated_images" / f"_env_{page_index}.png"
             env_refs: List[str] = []
             if loc:
                 for rp in assets.get("locations", {}).get(loc, {}).get("refs", []):
@@ -381,9 +513,8 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
                     "Create ONLY the environment/background for a children's book page. "
                     f"Do NOT include any characters or animals. Scene: {desc}. {global_style}"
                 )
-            resp = grok_image(env_prompt, env_refs[:1] if env_refs else [])
-            download(resp.url, env_path)
-            base_image = str(env_path.relative_to(proj))
+            refresh    = refresh_background or page.get("refresh_background", False)
+            base_image = str(env_plate(env_prompt, env_refs[:1], loc, refresh).relative_to(proj))
 
         refs: List[str] = []
         base_uri = encode_uri(proj / base_image, REF_MAX_SIDE_LOC, 85)
@@ -429,16 +560,23 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
 
     return dict(
         encode_uri=encode_uri,
+        uri_stats=uri_stats,
         grok_image=grok_image,
         rewrite=rewrite,
+        rewrite_cache=rewrite_cache,
+        rewrite_batch=rewrite_batch,
         download=download,
         render_overlay=render_overlay,
         render_title=render_title,
         char_refs=char_refs,
         global_style=global_style,
         build_page_image=build_page_image,
+        plate_stats=plate_stats,
+        api=api,
+        api_usage=api_usage,
         consistency_rules=consistency_rules,
         no_text_block=no_text_block,
+        checkpoint=checkpoint,
         assets=assets,
     )
 
@@ -447,17 +585,12 @@ def _build_helpers(client, proj: Path, manifest: dict, log):
 # PHASE 1 — Generate all images
 # ─────────────────────────────────────────────────────────────────
 
-def run_images(project_id: str, proj: Path, job_id: str, job_status: dict):
-    def log(msg: str, progress: int = None):
-        print(f"[{job_id}] {msg}", flush=True)
-        job_status[job_id]["log"].append(msg)
-        if progress is not None:
-            job_status[job_id]["progress"] = progress
+def run_images(project_id: str, proj: Path, job_id: str, jobs: JobStore, resume: bool = False,
+               trace: bool = False):
+    log = _job_logger(jobs, job_id)
+    rec = metrics.start_job(project_id, job_id, "images")
 
     try:
-        if not XAI_AVAILABLE:
-            raise RuntimeError("xai_sdk not installed.")
-
         with open(proj / "manifest.json", encoding="utf-8") as f:
             manifest = json.load(f)
 
@@ -465,8 +598,9 @@ def run_images(project_id: str, proj: Path, job_id: str, job_status: dict):
         if not api_key:
             raise ValueError("No xAI API key in manifest.")
 
-        client = Client(api_key=api_key)
-        h      = _build_helpers(client, proj, manifest, log)
+        client = make_client(api_key)
+        h      = _build_helpers(client, proj, manifest, log,
+                                 lambda: jobs.checkpoint(job_id))
         pages  = manifest.get("pages", [])
         title_cfg = manifest.get("title")
 
@@ -474,10 +608,13 @@ def run_images(project_id: str, proj: Path, job_id: str, job_status: dict):
 
         log("Starting image generation...", 5)
 
+        keys = _image_keys(proj, manifest)
+
         # Title page
         title_img_path = proj / "generated_images" / "title_page.png"
-        if title_cfg:
-            log("Generating title page...", 10)
+
+        def build_title():
+            log("Generating title page...")
             title_desc = h["rewrite"](title_cfg.get("raw_description", "")) or title_cfg.get("raw_description", "")
             title_text = title_cfg.get("title_text", "My Adventure")
             title_base = title_cfg.get("base_image")
@@ -507,54 +644,117 @@ def run_images(project_id: str, proj: Path, job_id: str, job_status: dict):
             resp = h["grok_image"](prompt, refs[:MAX_INPUT_IMAGES])
             h["download"](resp.url, title_img_path)
             h["render_title"](title_img_path, title_text)
-            log("Title page done.", 15)
 
         # Content pages
         total = len(pages)
-        for i, page in enumerate(pages):
-            pct = 15 + int(((i + 1) / total) * 80)
-            log(f"Generating page {i+1}/{total}...", pct)
-            img_path = proj / "generated_images" / f"page_{i+1}.png"
-            h["build_page_image"](page, img_path, i + 1)
-            log(f"Page {i+1} done.", pct)
-
-        job_status[job_id]["status"] = "review"
-        job_status[job_id]["progress"] = 100
-        log("All images ready. Review each page, then click Finalize.")
 
+        def build_page(i: int, page: dict):
+            def run():
+                _mark_image(proj, i + 1, None)
+                log(f"Generating page {i+1}/{total}...")
+                img_path = proj / "generated_images" / f"page_{i+1}.png"
+                with metrics.page(i + 1):
+                    narration = h["build_page_image"](page, img_path, i + 1)
+                _record_narration(proj, i + 1, narration)
+                return narration
+            return run
+
+        # Title and pages are independent, so schedule them all on one pool
+        def start_title():
+            _mark_image(proj, 0, None)
+            with metrics.page(0):
+                build_title()
+
+        tasks = [(0, start_title)] if title_cfg else []
+        tasks += [(i + 1, build_page(i, page)) for i, page in enumerate(pages)]
+
+        ready: List[dict] = []
+        if resume:
+            built = _load_image_record(proj)["pages"]
+
+            def current(page_index: int) -> bool:
+                name = "title_page.png" if page_index == 0 else f"page_{page_index}.png"
+                return (built.get(str(page_index)) == keys[page_index]
+                        and (proj / "generated_images" / name).exists())
+
+            ready = [_ready_entry(proj, idx) for idx, _ in tasks if current(idx)]
+            tasks = [(idx, fn) for idx, fn in tasks if not current(idx)]
+            log(f"Resuming: {len(ready)} image(s) unchanged since the last run, "
+                f"{len(tasks)} to generate.")
+            if ready:
+                jobs.update(job_id, ready=ready)
+
+        # One structured pass over the manuscript instead of a chat call per text
+        texts = []
+        for idx, _ in tasks:
+            spec   = title_cfg if idx == 0 else pages[idx - 1]
+            texts += [spec.get("raw_description", ""), spec.get("raw_narration_text", "")]
+        st = h["rewrite_batch"](texts)
+        if st["texts"]:
+            missed = st["texts"] - st["rewritten"]
+            log(f"Rewrote {st['rewritten']}/{st['texts']} text(s) in {st['calls']} batched call(s)."
+                + (f" {missed} will be rewritten individually." if missed else ""), 8)
+
+        workers = _parallelism(manifest, "max_parallel_pages", MAX_PARALLEL_PAGES)
+        log(f"Scheduling {len(tasks)} image(s) on {min(workers, max(1, len(tasks)))} worker(s)...", 10)
+
+        done = 0
+
+        def on_done(page_index: int, _):
+            nonlocal done
+            done += 1
+            _mark_image(proj, page_index, keys[page_index])
+            log(f"{'Title page' if page_index == 0 else f'Page {page_index}'} done.",
+                10 + int((done / len(tasks)) * 85))
+            entry = _ready_entry(proj, page_index, "images")
+            ready.append(entry)
+            jobs.update(job_id, ready=ready, api=dict(h["api_usage"]))
+
+        _run_parallel(tasks, workers, on_done, name=f"images-{job_id}")
+        cache, refs = h["rewrite_cache"], h["uri_stats"]
+        log(f"Rewrite cache: {cache.hits} hit(s), {cache.misses} miss(es). "
+            f"Reference cache: {refs['hits']} hit(s), {refs['misses']} miss(es). "
+            f"Shared in-flight API calls (process total): {IN_FLIGHT.shared}.")
+        plates = h["plate_stats"]
+        if plates["reused"] or plates["generated"]:
+            log(f"Background plates: {plates['reused']} reused, {plates['generated']} generated.")
+        log(rec.summary())
+        _save_trace(proj, jobs, job_id, rec, trace)
+
+        log("All images ready. Review each page, then click Finalize.", 100)
+        jobs.update(job_id, status="review", api=dict(h["api_usage"]))
+
+    except JobCancelled:
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _cancel_job(jobs, job_id)
     except Exception as e:
-        job_status[job_id]["status"] = "error"
-        job_status[job_id]["error"] = str(e)
-        job_status[job_id]["log"].append(f"FATAL: {e}")
-        job_status[job_id]["log"].append(traceback.format_exc())
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _fail_job(jobs, job_id, e)
 
 
 # ─────────────────────────────────────────────────────────────────
 # PHASE 1b — Regenerate a single page
 # ─────────────────────────────────────────────────────────────────
 
-def run_regen_page(project_id: str, proj: Path, job_id: str,
-                   job_status: dict, page_index: int, extra_instruction: str = ""):
-    def log(msg: str, progress: int = None):
-        print(f"[{job_id}] {msg}", flush=True)
-        job_status[job_id]["log"].append(msg)
-        if progress is not None:
-            job_status[job_id]["progress"] = progress
+def run_regen_page(project_id: str, proj: Path, job_id: str, jobs: JobStore,
+                   page_index: int, extra_instruction: str = "", refresh_background: bool = False,
+                   trace: bool = False):
+    log = _job_logger(jobs, job_id)
+    rec = metrics.start_job(project_id, job_id, "regen", page_index)
 
     try:
-        if not XAI_AVAILABLE:
-            raise RuntimeError("xai_sdk not installed.")
-
         with open(proj / "manifest.json", encoding="utf-8") as f:
             manifest = json.load(f)
 
         api_key = manifest.get("api_key", "").strip()
-        client  = Client(api_key=api_key)
-        h       = _build_helpers(client, proj, manifest, log)
+        client  = make_client(api_key)
+        h       = _build_helpers(client, proj, manifest, log,
+                                  lambda: jobs.checkpoint(job_id))
         pages   = manifest.get("pages", [])
 
         # Set img_path early so it's always defined
         img_path = proj / "generated_images" / "title_page.png"
+        _mark_image(proj, page_index, None)
 
         if page_index == 0:
             # Regenerate title page
@@ -601,40 +801,43 @@ def run_regen_page(project_id: str, proj: Path, job_id: str,
                 )
             img_path = proj / "generated_images" / f"page_{page_index}.png"
             log(f"Regenerating page {page_index}...", 10)
-            h["build_page_image"](page, img_path, page_index)
-
-        job_status[job_id]["status"] = "done"
-        job_status[job_id]["progress"] = 100
-        log(f"Page {page_index} regenerated.")
-
+            narration = h["build_page_image"](page, img_path, page_index, refresh_background)
+            _record_narration(proj, page_index, narration)
+            if h["plate_stats"]["reused"]:
+                log("Reused the cached background plate.")
+
+        log(rec.summary())
+        _save_trace(proj, jobs, job_id, rec, trace)
+        # Keyed by the manifest alone, so a resumed run keeps this hand-tuned page
+        _mark_image(proj, page_index, _image_keys(proj, manifest).get(page_index))
+        log(f"Page {page_index} regenerated.", 100)
+        entry = _ready_entry(proj, page_index, "regen")
+        jobs.update(job_id, status="done", ready=[entry], api=dict(h["api_usage"]))
+
+    except JobCancelled:
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _cancel_job(jobs, job_id)
     except Exception as e:
-        job_status[job_id]["status"] = "error"
-        job_status[job_id]["error"] = str(e)
-        job_status[job_id]["log"].append(f"FATAL: {e}")
-        job_status[job_id]["log"].append(traceback.format_exc())
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _fail_job(jobs, job_id, e)
 
 
 # ─────────────────────────────────────────────────────────────────
 # PHASE 2 — Finalize: PDF + videos
 # ─────────────────────────────────────────────────────────────────
 
-def run_finalize(project_id: str, proj: Path, job_id: str, job_status: dict):
-    def log(msg: str, progress: int = None):
-        print(f"[{job_id}] {msg}", flush=True)
-        job_status[job_id]["log"].append(msg)
-        if progress is not None:
-            job_status[job_id]["progress"] = progress
+def run_finalize(project_id: str, proj: Path, job_id: str, jobs: JobStore, trace: bool = False):
+    log = _job_logger(jobs, job_id)
+    rec = metrics.start_job(project_id, job_id, "finalize")
 
     try:
-        if not XAI_AVAILABLE:
-            raise RuntimeError("xai_sdk not installed.")
-
         with open(proj / "manifest.json", encoding="utf-8") as f:
             manifest = json.load(f)
 
         api_key = manifest.get("api_key", "").strip()
-        client  = Client(api_key=api_key)
-        h       = _build_helpers(client, proj, manifest, log)
+        client  = make_client(api_key)
+        h       = _build_helpers(client, proj, manifest, log,
+                                  lambda: jobs.checkpoint(job_id))
         pages   = manifest.get("pages", [])
 
         (proj / "book_pdfs").mkdir(exist_ok=True)
@@ -650,78 +853,161 @@ def run_finalize(project_id: str, proj: Path, job_id: str, job_status: dict):
             if p.exists():
                 image_paths.append(p)
 
-        # Build PDF — normalise every page to portrait 768×1024
-        log("Building PDF...", 10)
-        TARGET_W, TARGET_H = 768, 1024
-        imgs = []
-        for p in image_paths:
-            img = Image.open(p).convert("RGB")
-            if img.size != (TARGET_W, TARGET_H):
-                img = img.resize((TARGET_W, TARGET_H), Image.LANCZOS)
-            imgs.append(img)
-        if imgs:
-            pdf_path = proj / "book_pdfs" / "story_book.pdf"
-            imgs[0].save(str(pdf_path), "PDF", resolution=150.0,
-                         save_all=True, append_images=imgs[1:])
-            log("PDF created.", 30)
+        record      = _load_build_record(proj)
+        record_lock = threading.Lock()
+        digests     = {p: file_digest(p) for p in image_paths}
+
+        def save_record(**updates):
+            with record_lock:
+                record.update(updates)
+                write_json_atomic(proj / "build.json", record)
+
+        # Build PDF — one 768×1024 portrait page per image, streamed to disk
+        pdf_path    = proj / "book_pdfs" / "story_book.pdf"
+        pdf_profile = manifest.get("pdf_profile") or DEFAULT_PDF_PROFILE
+        pdf_key     = content_key(f"pdf:{pdf_profile}", *(f"{p.name}:{digests[p]}" for p in image_paths))
+
+        def build_pdf():
+            if not image_paths:
+                return
+            reuse = record.get("pdf") == pdf_key and pdf_path.exists()
+            metrics.CACHE_LOOKUPS.inc(cache="pdf", result="hit" if reuse else "miss")
+            if reuse:
+                log("PDF unchanged — reusing.")
+                return
+            with metrics.span("pdf"):
+                st = write_pdf(image_paths, pdf_path, pdf_profile)
+            save_record(pdf=pdf_key)
+            _record_artifact(proj, "book_pdfs/story_book.pdf", "finalize")
+            log(f"PDF created ({st['pages']} pages, {st['bytes'] / 1024:.0f} KiB, {pdf_profile}).")
+
+        # The PDF is local CPU work, so build it while the video jobs wait on the network
+        log("Building PDF...", 5)
+        pdf_pool   = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pdf-{job_id}")
+        pdf_future = pdf_pool.submit(metrics.carry(build_pdf))
+        pdf_pool.shutdown(wait=False)
 
         # Generate videos (content pages only, skip title)
-        log("Generating videos...", 35)
-        video_paths: List[Path] = []
+        log("Generating videos...", 10)
+        narrations = _load_narrations(proj)
         total = len(pages)
-
-        for i, page in enumerate(pages):
-            pct = 35 + int(((i + 1) / total) * 55)
-            img_path = proj / "generated_images" / f"page_{i+1}.png"
-            if not img_path.exists():
-                log(f"Skipping video {i+1} — image missing")
-                continue
-
-            duration  = page.get("duration_seconds", 10)
-            narration = h["rewrite"](page.get("raw_narration_text", "")) or page.get("raw_narration_text", "")
-            motion    = page.get("motion_prompt", "Gentle scene movement and character expressions")
-            image_uri = h["encode_uri"](img_path, 1280, 80)
-            if not image_uri:
-                continue
-
-            log(f"Generating video {i+1}/{total}...", pct)
-            vprompt = (
-                f"{motion}. {h['global_style']} "
-                "ABSOLUTE RULE: Off-screen narrator voiceover only. "
-                "Characters do NOT speak. NO mouth movement. No lip sync. No speech bubbles. "
-                f"Read as voiceover: '{narration}'. Keep on-screen text panel readable."
-            )
-            try:
-                resp = client.video.generate(
-                    prompt=vprompt, image_url=image_uri,
-                    duration=duration, aspect_ratio="16:9",
-                    resolution="720p", model="grok-imagine-video",
+        video_keys: Dict[int, str] = {}
+        reused = 0
+
+        def build_video(i: int, page: dict):
+            def run() -> Optional[Path]:
+                nonlocal reused
+                img_path = proj / "generated_images" / f"page_{i+1}.png"
+                if not img_path.exists():
+                    log(f"Skipping video {i+1} — image missing")
+                    return None
+
+                duration  = page.get("duration_seconds", 10)
+                # Prefer the exact text rendered onto the page; rewrite() is cached otherwise
+                narration = (narrations.get(str(i + 1))
+                             or h["rewrite"](page.get("raw_narration_text", ""))
+                             or page.get("raw_narration_text", ""))
+                motion    = page.get("motion_prompt", "Gentle scene movement and character expressions")
+                vprompt = (
+                    f"{motion}. {h['global_style']} "
+                    "ABSOLUTE RULE: Off-screen narrator voiceover only. "
+                    "Characters do NOT speak. NO mouth movement. No lip sync. No speech bubbles. "
+                    f"Read as voiceover: '{narration}'. Keep on-screen text panel readable."
                 )
                 vid_path = proj / "generated_videos" / f"page_{i+1}.mp4"
-                h["download"](resp.url, vid_path)
-                video_paths.append(vid_path)
+                key = content_key(digests[img_path], vprompt, str(duration),
+                                  VIDEO_MODEL, VIDEO_ASPECT, VIDEO_RESOLUTION)
+                video_keys[i] = key
+                reuse = record["videos"].get(str(i + 1)) == key and vid_path.exists()
+                metrics.CACHE_LOOKUPS.inc(cache="video", result="hit" if reuse else "miss")
+                if reuse:
+                    with record_lock:           # runs on the video pool's threads
+                        reused += 1
+                    log(f"Video {i+1} unchanged — reusing.")
+                    return vid_path
+
+                image_uri = h["encode_uri"](img_path, 1280, 80)
+                if not image_uri:
+                    return None
+
+                h["checkpoint"]()
+                log(f"Generating video {i+1}/{total}...")
+                try:
+                    with metrics.span("video_generate"):
+                        resp = h["api"]("video", VIDEO_MODEL, lambda: client.video.generate(
+                            prompt=vprompt, image_url=image_uri,
+                            duration=duration, aspect_ratio=VIDEO_ASPECT,
+                            resolution=VIDEO_RESOLUTION, model=VIDEO_MODEL,
+                        ))
+                    h["download"](resp.url, vid_path)
+                    _record_artifact(proj, f"generated_videos/{vid_path.name}", "finalize")
+                    with record_lock:
+                        record["videos"][str(i + 1)] = key
+                    save_record()
+                    return vid_path
+                except (JobCancelled, CircuitOpen):
+                    # An open breaker fails every remaining clip too; stop rather than
+                    # finish a movie with pages silently missing
+                    raise
+                except Exception as e:
+                    log(f"Video {i+1} failed: {e}")
+                    return None
+
+            def tagged() -> Optional[Path]:
+                with metrics.page(i + 1):
+                    return run()
+            return tagged
+
+        finished: Dict[int, Path] = {}
+        done = 0
+
+        def on_video(i: int, vid_path: Optional[Path]):
+            nonlocal done
+            if pdf_future.done() and pdf_future.exception():
+                # Fail now and cancel the clips not yet started, instead of paying for them
+                pdf_future.result()
+            done += 1
+            pct = 10 + int((done / total) * 80)
+            if vid_path:
+                finished[i] = vid_path
                 log(f"Video {i+1} done.", pct)
-            except Exception as e:
-                log(f"Video {i+1} failed: {e}")
+            else:
+                jobs.update(job_id, progress=pct)
+            jobs.update(job_id, api=dict(h["api_usage"]))
+
+        workers = _parallelism(manifest, "max_parallel_videos", MAX_PARALLEL_VIDEOS)
+        _run_parallel([(i, build_video(i, page)) for i, page in enumerate(pages)],
+                      workers, on_video, name=f"videos-{job_id}")
+        video_paths: List[Path] = [finished[i] for i in sorted(finished)]
+        if reused:
+            log(f"Reused {reused}/{total} unchanged video(s).")
+
+        pdf_future.result()
 
         # Assemble final video
-        if video_paths:
+        final_path = proj / "final_video.mp4"
+        final_key  = content_key(*(video_keys[i] for i in sorted(finished)))
+        if video_paths and record.get("final") == final_key and final_path.exists():
+            log("Final video unchanged — reusing.", 99)
+        elif video_paths:
             log("Assembling final video...", 92)
             try:
-                from moviepy.editor import VideoFileClip, concatenate_videoclips
-                clips = [VideoFileClip(str(p)) for p in video_paths]
-                final = concatenate_videoclips(clips, method="compose")
-                final.write_videofile(str(proj / "final_video.mp4"), fps=24, logger=None)
-                log("Final video ready.", 99)
+                with metrics.span("assemble"):
+                    engine = assemble(video_paths, final_path, log)
+                save_record(final=final_key)
+                _record_artifact(proj, "final_video.mp4", "finalize")
+                log(f"Final video ready ({engine}).", 99)
             except Exception as e:
                 log(f"Video assembly failed: {e}")
 
-        job_status[job_id]["status"] = "done"
-        job_status[job_id]["progress"] = 100
-        log("All done! ✨")
+        log(rec.summary())
+        _save_trace(proj, jobs, job_id, rec, trace)
+        log("All done! ✨", 100)
+        jobs.update(job_id, status="done", api=dict(h["api_usage"]))
 
+    except JobCancelled:
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _cancel_job(jobs, job_id)
     except Exception as e:
-        job_status[job_id]["status"] = "error"
-        job_status[job_id]["error"] = str(e)
-        job_status[job_id]["log"].append(f"FATAL: {e}")
-        job_status[job_id]["log"].append(traceback.format_exc())
+        _save_trace(proj, jobs, job_id, rec, trace)
+        _fail_job(jobs, job_id, e)
@@ -0,0 +1,115 @@
+"""
+pipeline/ingest.py
+Reference uploads. Each file is stored once per project under its sha256 in
+assets/.blobs, and the name the manifest refers to (assets/<type>s/<slug>.ext)
+is a hard link to it, so uploading the same photo again costs no space. A
+blob is deleted once re-uploading over its last name leaves it unlinked.
+Downscaled derivatives are rendered ahead of time so generation doesn't have
+to decode full-size originals.
+"""
+import fcntl
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable
+
+from PIL import Image
+
+from .cache import content_key
+
+BLOB_DIR = Path("assets") / ".blobs"
+
+
+def blob_dir(proj: Path) -> Path:
+    d = proj / BLOB_DIR
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+@contextmanager
+def _locked(proj: Path):
+    """Serialize blob stores across threads and worker processes for one project."""
+    with open(blob_dir(proj) / ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def store(proj: Path, tmp: Path, digest: str, dest: Path) -> bool:
+    """
+    Move a fully written upload into the blob store and point dest at it.
+    Returns True when an identical file was already stored.
+    """
+    with _locked(proj):
+        blob = blob_dir(proj) / f"{digest}{dest.suffix.lower()}"
+        duplicate = blob.exists()
+        if duplicate:
+            tmp.unlink()
+        else:
+            os.replace(tmp, blob)
+        if dest.exists() and os.path.samefile(dest, blob):
+            return duplicate
+        try:
+            old = dest.stat()
+        except FileNotFoundError:
+            old = None
+        fd, link = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".tmp")
+        os.close(fd)
+        os.unlink(link)
+        try:
+            os.link(blob, link)
+        except OSError:                     # no hard links on this filesystem
+            shutil.copyfile(blob, link)
+        os.replace(link, dest)
+        if old is not None:
+            _drop_unlinked(blob.parent, old)
+    return duplicate
+
+
+def _drop_unlinked(d: Path, old: os.stat_result):
+    """Delete the blob dest used to point at, if no other name links to it any more."""
+    for e in os.scandir(d):
+        if e.inode() == old.st_ino and e.is_file(follow_symlinks=False):
+            st = e.stat(follow_symlinks=False)
+            if st.st_dev == old.st_dev and st.st_nlink == 1:
+                os.unlink(e.path)
+            return
+
+
+# ── Derivatives ──────────────────────────────────────────────────────────────
+def derivative_path(proj: Path, src: Path, side: int) -> Path:
+    # Keyed by inode, so every name linked to the same blob shares its derivatives
+    st = src.stat()
+    key = content_key(str(st.st_dev), str(st.st_ino), str(st.st_mtime_ns), str(st.st_size), str(side))
+    return proj / ".cache" / "refs" / f"{key}.png"
+
+
+def make_derivatives(proj: Path, src: Path, sides: Iterable[int]):
+    """Render src with its longest side capped at each of `sides`, decoding it once."""
+    todo = [s for s in sorted(set(sides), reverse=True) if not derivative_path(proj, src, s).exists()]
+    if not todo:
+        return
+    with Image.open(src) as im:
+        im.draft("RGB", (todo[0], todo[0]))
+        img = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+    for side in todo:
+        if max(img.size) > side:
+            scale = side / float(max(img.size))
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                             Image.LANCZOS)
+        out = derivative_path(proj, src, side)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, "PNG", compress_level=1)
+        os.replace(tmp, out)
+
+
+def best_source(proj: Path, src: Path, max_side: int) -> Path:
+    """A prepared derivative of src at exactly max_side, or src itself."""
+    try:
+        d = derivative_path(proj, src, max_side)
+    except OSError:
+        return src
+    return d if d.exists() else src
@@ -0,0 +1,395 @@
+"""
+pipeline/jobs.py
+Job store shared by the API and the pipeline phases.
+  SqliteJobStore  — durable, safe to share between uvicorn worker processes (default)
+  MemoryJobStore  — single-process, nothing persisted
+Logs are kept as ring buffers of the last JOB_LOG_LINES lines, and finished
+jobs expire JOB_TTL_SECONDS after they stop running.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+JOB_LOG_LINES    = int(os.environ.get("JOB_LOG_LINES", "500"))
+JOB_LOG_LINE_MAX = 8000
+JOB_TTL_SECONDS  = int(os.environ.get("JOB_TTL_SECONDS", str(24 * 3600)))
+JOB_STORE        = os.environ.get("JOB_STORE", "sqlite")
+
+_COLUMNS = ("project_id", "status", "progress", "error")
+
+# A job is active until it reaches any other status (review, done, error, cancelled)
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    """Raised inside a pipeline phase when the job has been asked to stop."""
+
+
+def _proc_start(pid: int) -> Optional[str]:
+    """Kernel start time of a process, so a reused pid isn't mistaken for the original."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{_proc_start(os.getpid()) or time.time()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    try:
+        host, pid, started = owner.rsplit(":", 2)
+    except ValueError:
+        return False
+    if host != socket.gethostname():
+        return True                     # another machine's job; not ours to judge
+    return _proc_start(int(pid)) == started
+
+
+class JobStore(ABC):
+    @abstractmethod
+    def create(self, job_id: str, project_id: str, **fields):
+        ...
+
+    @abstractmethod
+    def create_unique(self, job_id: str, project_id: str, dedup_key: str, **fields) -> str:
+        """
+        Create the job unless the project already has an active one with the same
+        dedup_key. Returns whichever job_id now represents the request.
+        """
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str, with_log: bool = True, with_ready: bool = True) -> Optional[dict]:
+        """with_ready=False gives the length of the job's ready list (ready_count) instead of it."""
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields):
+        ...
+
+    @abstractmethod
+    def append_log(self, job_id: str, msg: str, progress: Optional[int] = None):
+        ...
+
+    @abstractmethod
+    def log_since(self, job_id: str, seq: int) -> List[Tuple[int, str]]:
+        """Log lines with a sequence number greater than seq that are still retained."""
+        ...
+
+    @abstractmethod
+    def ready_since(self, job_id: str, n: int) -> List[dict]:
+        """Entries of the job's ready list from index n on."""
+        ...
+
+    @abstractmethod
+    def claim(self, job_id: str, project_id: str, max_running: int, max_per_project: int) -> bool:
+        """
+        Mark a queued job running if fewer than max_running jobs run in total and
+        fewer than max_per_project for its project, counted across every process
+        sharing the store. False leaves it queued.
+        """
+        ...
+
+    def checkpoint(self, job_id: str):
+        """Raise JobCancelled if a cancel was requested; phases call this between API calls."""
+        job = self.get(job_id, with_log=False)
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+    @abstractmethod
+    def purge_expired(self):
+        ...
+
+
+# ── In-memory ───────────────────────────────────────────────────────────────────
+class MemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, project_id, **fields):
+        self.create_unique(job_id, project_id, None, **fields)
+
+    def create_unique(self, job_id, project_id, dedup_key, **fields):
+        self.purge_expired()
+        job = {"status": "running", "project_id": project_id, "progress": 0,
+               "log": deque(maxlen=JOB_LOG_LINES), "log_seq": 0,
+               "created": time.time(), "finished": None}
+        job.update(fields)
+        with self._lock:
+            if dedup_key is not None:
+                for jid, other in self._jobs.items():
+                    if (other["project_id"] == project_id and other.get("_dedup") == dedup_key
+                            and other["status"] in ACTIVE_STATUSES):
+                        return jid
+            job["_dedup"] = dedup_key
+            self._jobs[job_id] = job
+        return job_id
+
+    def get(self, job_id, with_log=True, with_ready=True):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            out = {k: v for k, v in job.items() if k not in ("log", "finished", "created", "_dedup")}
+            if with_log:
+                out["log"] = [msg for _, msg in job["log"]]
+            if not with_ready:
+                out["ready_count"] = len(out.pop("ready", None) or [])
+            return out
+
+    def ready_since(self, job_id, n):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return list((job.get("ready") or [])[n:]) if job else []
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            if fields.get("status", "running") not in ACTIVE_STATUSES and job["finished"] is None:
+                job["finished"] = time.time()
+
+    def claim(self, job_id, project_id, max_running, max_per_project):
+        with self._lock:
+            running = [j for j in self._jobs.values() if j["status"] == "running"]
+            if (len(running) >= max_running
+                    or sum(j["project_id"] == project_id for j in running) >= max_per_project):
+                return False
+            self._jobs[job_id]["status"] = "running"
+            return True
+
+    def append_log(self, job_id, msg, progress=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["log_seq"] += 1
+            job["log"].append((job["log_seq"], msg[:JOB_LOG_LINE_MAX]))
+            if progress is not None:
+                job["progress"] = progress
+
+    def log_since(self, job_id, seq):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return [(s, m) for s, m in job["log"] if s > seq] if job else []
+
+    def purge_expired(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        with self._lock:
+            for jid in [j for j, v in self._jobs.items() if v["finished"] and v["finished"] < cutoff]:
+                del self._jobs[jid]
+
+
+# ── SQLite ──────────────────────────────────────────────────────────────────────
+class SqliteJobStore(JobStore):
+    PURGE_EVERY = 300      # seconds between expiry sweeps
+
+    def __init__(self, path: Path):
+        self.path   = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._conn() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id     TEXT PRIMARY KEY,
+                    project_id TEXT NOT NULL,
+                    status     TEXT NOT NULL,
+                    progress   INTEGER NOT NULL DEFAULT 0,
+                    error      TEXT,
+                    data       TEXT NOT NULL DEFAULT '{}',
+                    log_seq    INTEGER NOT NULL DEFAULT 0,
+                    owner      TEXT,
+                    created    REAL NOT NULL,
+                    finished   REAL
+                );
+                CREATE TABLE IF NOT EXISTS job_logs (
+                    job_id TEXT NOT NULL,
+                    seq    INTEGER NOT NULL,
+                    msg    TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished);
+            """)
+            if "dedup_key" not in [r[1] for r in db.execute("PRAGMA table_info(jobs)")]:
+                db.execute("ALTER TABLE jobs ADD COLUMN dedup_key TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs(project_id, dedup_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, project_id)")
+        self._reap_orphans()
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _reap_orphans(self):
+        """Jobs left queued or running by a process that no longer exists will never finish."""
+        db = self._conn()
+        rows = db.execute("SELECT job_id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        for job_id, owner in rows:
+            if owner != OWNER and not _owner_alive(owner or ""):
+                self.update(job_id, status="error", error="Interrupted: the server restarted.")
+
+    def create(self, job_id, project_id, **fields):
+        self.create_unique(job_id, project_id, None, **fields)
+
+    def create_unique(self, job_id, project_id, dedup_key, **fields):
+        now = time.time()
+        if now - self._last_purge > self.PURGE_EVERY:
+            self._last_purge = now
+            self.purge_expired()
+        cols = {"status": "running", "progress": 0, "error": None}
+        extra = {}
+        for k, v in fields.items():
+            (cols if k in _COLUMNS else extra)[k] = v
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if dedup_key is not None:
+                row = db.execute(
+                    "SELECT job_id FROM jobs WHERE project_id = ? AND dedup_key = ? "
+                    "AND status IN ('queued', 'running') LIMIT 1",
+                    (project_id, dedup_key),
+                ).fetchone()
+                if row:
+                    db.execute("COMMIT")
+                    return row[0]
+            db.execute(
+                "INSERT INTO jobs (job_id, project_id, status, progress, error, data, owner, created, "
+                "dedup_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, project_id, cols["status"], cols["progress"], cols["error"],
+                 json.dumps(extra), OWNER, now, dedup_key),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def get(self, job_id, with_log=True, with_ready=True):
+        db  = self._conn()
+        # Leave the ready list (which grows with the book) in SQLite unless it's wanted
+        data_col = ("data" if with_ready else
+                    "json_remove(data, '$.ready'), COALESCE(json_array_length(data, '$.ready'), 0)")
+        row = db.execute(
+            f"SELECT project_id, status, progress, error, log_seq, {data_col} FROM jobs WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        project_id, status, progress, error, log_seq, data, *ready_count = row
+        job = json.loads(data)
+        if not with_ready:
+            job["ready_count"] = ready_count[0]
+        job.update(status=status, project_id=project_id, progress=progress, log_seq=log_seq)
+        if error is not None:
+            job["error"] = error
+        if with_log:
+            job["log"] = [m for (m,) in db.execute(
+                "SELECT msg FROM job_logs WHERE job_id = ? ORDER BY seq", (job_id,))]
+        return job
+
+    def update(self, job_id, **fields):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            sets, args = [], []
+            extra = {k: v for k, v in fields.items() if k not in _COLUMNS}
+            for k in _COLUMNS:
+                if k in fields:
+                    sets.append(f"{k} = ?")
+                    args.append(fields[k])
+            if extra:
+                (data,) = db.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                merged = json.loads(data)
+                merged.update(extra)
+                sets.append("data = ?")
+                args.append(json.dumps(merged))
+            if fields.get("status", "running") not in ACTIVE_STATUSES:
+                sets.append("finished = COALESCE(finished, ?)")
+                args.append(time.time())
+            if sets:
+                db.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE job_id = ?", (*args, job_id))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def claim(self, job_id, project_id, max_running, max_per_project):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            total, mine = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(project_id = ?), 0) FROM jobs WHERE status = 'running'",
+                (project_id,),
+            ).fetchone()
+            ok = total < max_running and mine < max_per_project
+            if ok:
+                db.execute("UPDATE jobs SET status = 'running' WHERE job_id = ?", (job_id,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ok
+
+    def append_log(self, job_id, msg, progress=None):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if progress is None:
+                db.execute("UPDATE jobs SET log_seq = log_seq + 1 WHERE job_id = ?", (job_id,))
+            else:
+                db.execute("UPDATE jobs SET log_seq = log_seq + 1, progress = ? WHERE job_id = ?",
+                           (progress, job_id))
+            (seq,) = db.execute("SELECT log_seq FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            db.execute("INSERT INTO job_logs (job_id, seq, msg) VALUES (?, ?, ?)",
+                       (job_id, seq, msg[:JOB_LOG_LINE_MAX]))
+            if seq > JOB_LOG_LINES:
+                db.execute("DELETE FROM job_logs WHERE job_id = ? AND seq <= ?",
+                           (job_id, seq - JOB_LOG_LINES))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def ready_since(self, job_id, n):
+        return [json.loads(v) for (v,) in self._conn().execute(
+            "SELECT value FROM jobs, json_each(jobs.data, '$.ready') WHERE job_id = ? AND key >= ? "
+            "ORDER BY key", (job_id, n))]
+
+    def log_since(self, job_id, seq):
+        return self._conn().execute(
+            "SELECT seq, msg FROM job_logs WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, seq),
+        ).fetchall()
+
+    def purge_expired(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM job_logs WHERE job_id IN "
+                       "(SELECT job_id FROM jobs WHERE finished IS NOT NULL AND finished < ?)", (cutoff,))
+            db.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+
+def open_job_store(path: Path) -> JobStore:
+    """JOB_STORE=memory keeps jobs in-process (single worker only); the default is SQLite."""
+    if JOB_STORE == "memory":
+        return MemoryJobStore()
+    return SqliteJobStore(path)
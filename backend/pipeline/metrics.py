@@ -0,0 +1,278 @@
+"""
+pipeline/metrics.py
+Timing spans and Prometheus metrics. Pipeline stages run inside span(name),
+which feeds the stage latency histogram and the running job's Recorder (spans
+tagged with project, job and page) so each job can report where its time went,
+and save it as a Chrome trace. render() is the text exposition GET /metrics
+serves. Values are per process: with several uvicorn workers, each scrape sees
+the worker that answered it.
+"""
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, object] = {}
+        self._lock  = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(l, "")) for l in self.labels)
+
+    def _labelset(self, key: tuple, extra: str = "") -> str:
+        parts = [f'{l}="{_escape(v)}"' for l, v in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._labelset(k)} {_fmt(v)}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {k: (list(c), s) for k, (c, s) in self._values.items()}
+        out = []
+        for key, (counts, total) in sorted(values.items()):
+            running = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = 'le="%s"' % ("+Inf" if le == float("inf") else _fmt(le))
+                out.append(f"{self.name}_bucket{self._labelset(key, le)} {running}")
+            out.append(f"{self.name}_sum{self._labelset(key)} {_fmt(round(total, 6))}")
+            out.append(f"{self.name}_count{self._labelset(key)} {running}")
+        return out
+
+
+class Gauge(_Metric):
+    """Read at scrape time: fn() returns {label values tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], fn: Callable[[], dict]):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        return [f"{self.name}{self._labelset(tuple(map(str, k)))} {_fmt(v)}"
+                for k, v in sorted(values.items())]
+
+
+def render() -> str:
+    lines = []
+    for m in list(REGISTRY):
+        lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}"] + m.samples()
+    return "\n".join(lines) + "\n"
+
+
+# ── Pipeline metrics ─────────────────────────────────────────────────────────
+STAGE_SECONDS  = Histogram("storybook_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+STAGE_FAILURES = Counter("storybook_stage_failures_total", "Pipeline stages that raised.", ("stage",))
+CACHE_LOOKUPS  = Counter("storybook_cache_lookups_total",
+                         "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+DOWNLOAD_BYTES = Counter("storybook_download_bytes_total", "Bytes downloaded from the asset CDN.")
+JOBS_FINISHED  = Counter("storybook_jobs_finished_total", "Jobs that stopped, by phase and final status.",
+                         ("phase", "status"))
+JOB_SECONDS    = Histogram("storybook_job_seconds", "Wall-clock time of a job once it starts running.",
+                           ("phase",), buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+
+
+# ── Spans ────────────────────────────────────────────────────────────────────
+class Recorder:
+    """
+    Every span one job ran, with its project, job, page and thread. Stage spans
+    make up the summary; detail spans (whole pages, each API attempt, rate-limit
+    waits) only appear in the trace.
+    """
+
+    def __init__(self, project: str, job: str, phase: str):
+        self.project = project
+        self.job     = job
+        self.phase   = phase
+        self.started = time.time()
+        self.thread  = threading.current_thread().name
+        self.spans: List[dict] = []
+        self._lock   = threading.Lock()
+
+    def add(self, stage: str, start: float, seconds: float, page: Optional[int], ok: bool,
+            detail: bool = False, args: Optional[dict] = None):
+        with self._lock:
+            self.spans.append({"stage": stage, "start": start, "seconds": seconds, "page": page,
+                               "ok": ok, "detail": detail, "args": args or {},
+                               "thread": threading.current_thread().name})
+
+    def summary(self) -> str:
+        """One line of total time per stage, slowest first (stages overlap across workers)."""
+        with self._lock:
+            spans = [s for s in self.spans if not s["detail"]]
+        by_stage: Dict[str, list] = {}
+        for s in spans:
+            acc = by_stage.setdefault(s["stage"], [0, 0.0])
+            acc[0] += 1
+            acc[1] += s["seconds"]
+        parts = [f"{stage} {n}× {total:.1f}s"
+                 for stage, (n, total) in sorted(by_stage.items(), key=lambda kv: -kv[1][1])]
+        return "Time by stage: " + (", ".join(parts) if parts else "none")
+
+    def chrome_trace(self) -> dict:
+        """
+        Trace-event JSON (open in Perfetto or chrome://tracing): one complete event
+        per span on its worker thread's track, under a span for the whole job.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        pid, end = os.getpid(), time.time()
+        tids: Dict[str, int] = {}
+
+        def tid(thread: str) -> int:
+            return tids.setdefault(thread, len(tids) + 1)
+
+        def us(t: float) -> int:
+            return int(round((t - self.started) * 1e6))
+
+        events = [{"name": f"{self.phase} {self.job}", "cat": "job", "ph": "X", "pid": pid,
+                   "tid": tid(self.thread), "ts": 0, "dur": us(end),
+                   "args": {"project": self.project, "job": self.job}}]
+        for s in spans:
+            args = dict(s["args"])
+            if s["page"] is not None:
+                args["page"] = s["page"]
+            if not s["ok"]:
+                args["failed"] = True
+            events.append({"name": s["stage"], "cat": "detail" if s["detail"] else "stage", "ph": "X",
+                           "pid": pid, "tid": tid(s["thread"]), "ts": us(s["start"]),
+                           "dur": max(1, int(round(s["seconds"] * 1e6))), "args": args})
+        meta = [{"name": "process_name", "ph": "M", "pid": pid,
+                 "args": {"name": f"{self.project} · {self.phase}"}}]
+        meta += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": n, "args": {"name": name}}
+                 for name, n in tids.items()]
+        meta += [{"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": n, "args": {"sort_index": n}}
+                 for n in tids.values()]
+        return {"traceEvents": meta + events, "displayTimeUnit": "ms",
+                "otherData": {"project": self.project, "job": self.job, "phase": self.phase,
+                              "started": self.started}}
+
+
+_recorder: contextvars.ContextVar = contextvars.ContextVar("metrics_recorder", default=None)
+_page:     contextvars.ContextVar = contextvars.ContextVar("metrics_page", default=None)
+
+
+def start_job(project: str, job: str, phase: str, page_index: Optional[int] = None) -> Recorder:
+    """Record this thread's spans (and those of tasks it carry()s) for the job."""
+    rec = Recorder(project, job, phase)
+    _recorder.set(rec)
+    _page.set(page_index)
+    return rec
+
+
+@contextmanager
+def page(page_index: int):
+    """Tag the spans inside with a page (0 = title page), under a span for the whole page."""
+    token, start, t0, ok = _page.set(page_index), time.time(), time.perf_counter(), False
+    try:
+        yield
+        ok = True
+    finally:
+        rec = _recorder.get()
+        if rec is not None:
+            rec.add("title page" if page_index == 0 else f"page {page_index}", start,
+                    time.perf_counter() - t0, page_index, ok, detail=True)
+        _page.reset(token)
+
+
+@contextmanager
+def span(stage: str):
+    start, t0, ok = time.time(), time.perf_counter(), False
+    try:
+        yield
+        ok = True
+    finally:
+        seconds = time.perf_counter() - t0
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if not ok:
+            STAGE_FAILURES.inc(stage=stage)
+        rec = _recorder.get()
+        if rec is not None:
+            rec.add(stage, start, seconds, _page.get(), ok)
+
+
+def note(name: str, seconds: float, ok: bool = True, **args):
+    """A detail span that just ended, for the job's trace only (no histogram)."""
+    rec = _recorder.get()
+    if rec is not None:
+        rec.add(name, time.time() - seconds, seconds, _page.get(), ok, detail=True, args=args)
+
+
+def timed(stage: str):
+    """Decorator: run the function inside span(stage)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
+
+
+def carry(fn: Callable) -> Callable:
+    """fn bound to a copy of the caller's job and page tags, for handing to a worker thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
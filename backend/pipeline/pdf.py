@@ -0,0 +1,122 @@
+"""
+pipeline/pdf.py
+Streaming PDF writer for the storybook. Pages are encoded as JPEG (DCTDecode)
+image XObjects in the cpu.py process pool, a few ahead of the writer, and
+written in order, so memory stays flat regardless of page count. Sources that
+are already JPEG at the target size are embedded byte-for-byte without
+re-encoding.
+"""
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, List
+
+from PIL import Image
+
+from . import cpu
+
+PAGE_W, PAGE_H = 768, 1024          # layout size in pixels at 150 dpi
+LAYOUT_DPI     = 150
+
+# dpi sets the embedded resolution for the same physical page size;
+# sources are never upsampled past their own pixel size.
+PDF_PROFILES = {
+    "screen": {"dpi": 150, "quality": 75},
+    "print":  {"dpi": 300, "quality": 92},
+}
+DEFAULT_PDF_PROFILE = os.environ.get("PDF_PROFILE", "screen")
+
+
+def _target_size(src_size, dpi: int):
+    scale = dpi / LAYOUT_DPI
+    w, h  = int(PAGE_W * scale), int(PAGE_H * scale)
+    # Don't invent pixels: cap at the source resolution, keeping the page aspect
+    if src_size[0] < w or src_size[1] < h:
+        fit = min(src_size[0] / PAGE_W, src_size[1] / PAGE_H)
+        w, h = max(PAGE_W, int(PAGE_W * fit)), max(PAGE_H, int(PAGE_H * fit))
+    return w, h
+
+
+def _page_jpeg(path: Path, dpi: int, quality: int):
+    """Return (jpeg bytes, width, height, colorspace, passed_through) for one page."""
+    with Image.open(path) as img:
+        size = _target_size(img.size, dpi)
+        if img.format == "JPEG" and img.mode in ("RGB", "L") and img.size == size:
+            cs = "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+            return path.read_bytes(), size[0], size[1], cs, True
+        page = img.convert("RGB")
+    if page.size != size:
+        page = page.resize(size, Image.LANCZOS)
+    buf = io.BytesIO()
+    page.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue(), size[0], size[1], "/DeviceRGB", False
+
+
+class _Writer:
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.offsets: dict = {}
+
+    def write(self, data: bytes):
+        self.f.write(data)
+
+    def obj(self, num: int, body: bytes, stream: bytes = None):
+        self.offsets[num] = self.f.tell()
+        self.write(f"{num} 0 obj\n".encode() + body)
+        if stream is not None:
+            self.write(b"\nstream\n")
+            self.write(stream)
+            self.write(b"\nendstream")
+        self.write(b"\nendobj\n")
+
+
+def write_pdf(image_paths: List[Path], out: Path, profile: str = DEFAULT_PDF_PROFILE) -> dict:
+    """Write image_paths as one page each to out. Returns {"pages", "bytes", "passthrough"}."""
+    opts   = PDF_PROFILES.get(profile, PDF_PROFILES["screen"])
+    page_w = PAGE_W * 72.0 / LAYOUT_DPI
+    page_h = PAGE_H * 72.0 / LAYOUT_DPI
+    passthrough = 0
+    kids: List[int] = []
+
+    fd, tmp = tempfile.mkstemp(dir=out.parent, prefix=f".{out.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            w = _Writer(f)
+            w.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            num = 3                                   # 1 = catalog, 2 = page tree
+            pages = cpu.imap(_page_jpeg, ((p, opts["dpi"], opts["quality"]) for p in image_paths))
+            for data, iw, ih, cs, copied in pages:
+                passthrough += copied
+                page_id, content_id, image_id = num, num + 1, num + 2
+                num += 3
+                w.obj(image_id, (
+                    f"<< /Type /XObject /Subtype /Image /Width {iw} /Height {ih} "
+                    f"/ColorSpace {cs} /BitsPerComponent 8 /Filter /DCTDecode "
+                    f"/Length {len(data)} >>").encode(), data)
+                content = f"q {page_w:.2f} 0 0 {page_h:.2f} 0 0 cm /Im0 Do Q".encode()
+                w.obj(content_id, f"<< /Length {len(content)} >>".encode(), content)
+                w.obj(page_id, (
+                    f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+                    f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                    f"/Contents {content_id} 0 R >>").encode())
+                kids.append(page_id)
+
+            w.obj(2, (f"<< /Type /Pages /Count {len(kids)} "
+                      f"/Kids [{' '.join(f'{k} 0 R' for k in kids)}] >>").encode())
+            w.obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+            xref_at = f.tell()
+            w.write(f"xref\n0 {num}\n0000000000 65535 f \n".encode())
+            for n in range(1, num):
+                w.write(f"{w.offsets[n]:010d} 00000 n \n".encode())
+            w.write(f"trailer\n<< /Size {num} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+            size = f.tell()
+        os.replace(tmp, out)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return {"pages": len(kids), "bytes": size, "passthrough": passthrough}
@@ -0,0 +1,329 @@
+"""
+pipeline/ratelimit.py
+Process-wide governor for xAI calls. Every image, chat and video request
+takes a token from its model's bucket and from its API key's bucket, retries
+transient failures with jittered exponential backoff (honouring any retry
+hint the server sends), halves the model's rate whenever it is throttled and
+creeps back up on success, and sheds calls outright while a circuit breaker
+is open for a model that keeps failing.
+"""
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from . import metrics
+from .jobs import JobCancelled
+
+
+def _per_min(name: str, default: str) -> float:
+    return max(0.1, float(os.environ.get(name, default))) / 60.0
+
+
+RATE_IMAGE        = _per_min("XAI_RATE_IMAGE", "60")       # requests per minute, per model
+RATE_CHAT         = _per_min("XAI_RATE_CHAT", "120")
+RATE_VIDEO        = _per_min("XAI_RATE_VIDEO", "20")
+RATE_PER_KEY      = _per_min("XAI_RATE_PER_KEY", "180")    # all models, per API key
+API_RETRIES       = int(os.environ.get("XAI_RETRIES", "4"))
+BACKOFF_BASE      = 1.0
+BACKOFF_MAX       = 30.0
+BREAKER_FAILURES  = int(os.environ.get("XAI_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN  = float(os.environ.get("XAI_BREAKER_COOLDOWN", "30"))
+WAIT_SLICE        = 0.5      # longest sleep between cancellation checks
+
+_KIND_RATES = {"image": RATE_IMAGE, "chat": RATE_CHAT, "video": RATE_VIDEO}
+
+# Errors that retrying can't fix
+_FATAL_CODES = {"INVALID_ARGUMENT", "PERMISSION_DENIED", "UNAUTHENTICATED", "NOT_FOUND",
+                "FAILED_PRECONDITION", "OUT_OF_RANGE", "UNIMPLEMENTED"}
+
+
+API_SECONDS = metrics.Histogram("storybook_api_seconds", "Latency of each xAI request attempt.",
+                                ("kind", "model"))
+API_WAIT    = metrics.Histogram("storybook_api_wait_seconds",
+                                "Time a request waited for rate-limit tokens.", ("kind",))
+API_CALLS   = metrics.Counter("storybook_api_calls_total",
+                              "xAI request attempts by outcome (ok, throttled, error, fatal, shed).",
+                              ("kind", "model", "outcome"))
+API_RETRIED = metrics.Counter("storybook_api_retries_total", "xAI requests retried after a failure.",
+                              ("kind", "model"))
+_OUTCOMES   = {"throttle": "throttled", "transient": "error", "fatal": "fatal"}
+
+
+class CircuitOpen(RuntimeError):
+    """The upstream for a model is failing; calls are shed until it cools down."""
+
+
+def _sleep(seconds: float, checkpoint: Callable[[], None]):
+    end = time.monotonic() + seconds
+    while True:
+        checkpoint()
+        left = end - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, WAIT_SLICE))
+
+
+def classify(e: BaseException) -> str:
+    """'throttle', 'fatal' or 'transient' for an exception raised by an API call."""
+    code = getattr(e, "code", None)
+    name = getattr(code() if callable(code) else code, "name", "")
+    if name == "RESOURCE_EXHAUSTED":
+        return "throttle"
+    if name in _FATAL_CODES:
+        return "fatal"
+    status = getattr(getattr(e, "response", None), "status_code", None) or getattr(e, "status_code", None)
+    if status == 429:
+        return "throttle"
+    if isinstance(status, int) and 400 <= status < 500:
+        return "fatal"
+    msg = str(e).lower()
+    if "rate limit" in msg or "too many requests" in msg:
+        return "throttle"
+    return "transient"
+
+
+def retry_hint(e: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from gRPC trailers, HTTP headers or the message."""
+    values = [getattr(e, "retry_after", None)]
+    trailers = getattr(e, "trailing_metadata", None)
+    if callable(trailers):
+        try:
+            values += [v for k, v in (trailers() or ()) if k.lower() == "retry-after"]
+        except Exception:
+            pass
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers is not None:
+        values.append(headers.get("retry-after"))
+    m = re.search(r"retry (?:after|in) (\d+(?:\.\d+)?)\s*s", str(e), re.I)
+    if m:
+        values.append(m.group(1))
+    for v in values:
+        try:
+            if v is not None:
+                return max(0.0, float(v))
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class TokenBucket:
+    """Refills at `rate` tokens/second up to `burst`; the rate adapts to throttling."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.max_rate = rate
+        self.rate     = rate
+        self.burst    = burst or max(1.0, rate * 10)
+        self.tokens   = self.burst
+        self.waiting  = 0
+        self._stamp   = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, checkpoint: Callable[[], None]) -> float:
+        """Take one token, waiting as needed. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return time.monotonic() - start
+                    wait = (1 - self.tokens) / self.rate
+                _sleep(min(wait, WAIT_SLICE), checkpoint)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def throttled(self):
+        with self._lock:
+            self.rate   = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class Breaker:
+    def __init__(self):
+        self.failures   = 0
+        self.opened_at  = None
+        self.probing    = False
+        self.prober     = None           # thread making the trial call
+        self._lock      = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= BREAKER_COOLDOWN else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True            # one trial call decides
+                self.prober  = threading.get_ident()
+                return True
+            return False
+
+    def abandon(self):
+        """This thread's trial call ended without an outcome (e.g. cancelled); let another probe."""
+        with self._lock:
+            if self.prober == threading.get_ident():
+                self.probing, self.prober = False, None
+
+    def record(self, ok: bool):
+        with self._lock:
+            self.probing, self.prober = False, None
+            if ok:
+                self.failures, self.opened_at = 0, None
+            else:
+                self.failures += 1
+                if self.failures >= BREAKER_FAILURES or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+
+
+class _Lane:
+    """Bucket, breaker and counters for one model."""
+
+    def __init__(self, rate: float):
+        self.bucket    = TokenBucket(rate)
+        self.breaker   = Breaker()
+        self.in_flight = 0
+        self.counts    = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0, "shed": 0}
+
+
+class Governor:
+    def __init__(self):
+        self._lanes: Dict[str, _Lane] = {}
+        self._keys: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _lane(self, kind: str, model: str) -> _Lane:
+        with self._lock:
+            lane = self._lanes.get(f"{kind}:{model}")
+            if lane is None:
+                lane = self._lanes[f"{kind}:{model}"] = _Lane(_KIND_RATES.get(kind, RATE_CHAT))
+            return lane
+
+    def _key_bucket(self, account: str) -> TokenBucket:
+        with self._lock:
+            b = self._keys.get(account)
+            if b is None:
+                b = self._keys[account] = TokenBucket(RATE_PER_KEY)
+            return b
+
+    def call(self, kind: str, model: str, account: str, fn: Callable[[], Any],
+             checkpoint: Callable[[], None] = lambda: None, usage: Optional[dict] = None) -> Any:
+        """
+        Run fn under the model's and API key's limits, retrying what can be retried.
+        `usage`, if given, accumulates this caller's calls/retries/throttled/waited_s.
+        """
+        lane, key_bucket = self._lane(kind, model), self._key_bucket(account)
+
+        def count(name: str, n: float = 1):
+            with self._lock:
+                if name in lane.counts:
+                    lane.counts[name] += n
+                if usage is not None:
+                    usage[name] = usage.get(name, 0) + n
+
+        for attempt in range(API_RETRIES + 1):
+            if not lane.breaker.allow():
+                count("shed")
+                API_CALLS.inc(kind=kind, model=model, outcome="shed")
+                raise CircuitOpen(f"{model} is failing repeatedly; pausing calls for "
+                                  f"{BREAKER_COOLDOWN:.0f}s. Try again shortly.")
+            try:
+                waited = lane.bucket.acquire(checkpoint) + key_bucket.acquire(checkpoint)
+                count("waited_s", round(waited, 3))
+                count("calls")
+                API_WAIT.observe(waited, kind=kind)
+                if waited >= 0.001:
+                    metrics.note("rate-limit wait", waited, kind=kind)
+                with self._lock:
+                    lane.in_flight += 1
+                start = time.monotonic()
+                try:
+                    out = fn()
+                except JobCancelled:
+                    raise                              # says nothing about the upstream
+                except Exception as e:
+                    kind_of, took = classify(e), time.monotonic() - start
+                    API_SECONDS.observe(took, kind=kind, model=model)
+                    API_CALLS.inc(kind=kind, model=model, outcome=_OUTCOMES[kind_of])
+                    metrics.note(f"xai {kind}", took, ok=False, model=model, attempt=attempt + 1,
+                                 outcome=_OUTCOMES[kind_of])
+                    if kind_of == "fatal":
+                        lane.breaker.record(True)      # the request was bad, not the upstream
+                        raise
+                    lane.breaker.record(False)
+                    if kind_of == "throttle":
+                        count("throttled")
+                        lane.bucket.throttled()
+                        key_bucket.throttled()
+                    if attempt == API_RETRIES:
+                        count("failed")
+                        raise
+                    count("retries")
+                    API_RETRIED.inc(kind=kind, model=model)
+                    delay = retry_hint(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                    delay = min(delay, BACKOFF_MAX * 4)
+                    _sleep(delay, checkpoint)
+                    metrics.note("retry backoff", delay, kind=kind)
+                else:
+                    took = time.monotonic() - start
+                    API_SECONDS.observe(took, kind=kind, model=model)
+                    API_CALLS.inc(kind=kind, model=model, outcome="ok")
+                    metrics.note(f"xai {kind}", took, model=model, attempt=attempt + 1, outcome="ok")
+                    lane.breaker.record(True)
+                    lane.bucket.succeeded()
+                    key_bucket.succeeded()
+                    return out
+                finally:
+                    with self._lock:
+                        lane.in_flight -= 1
+            finally:
+                lane.breaker.abandon()             # no-op once an outcome was recorded
+
+    def stats(self) -> dict:
+        with self._lock:
+            lanes = dict(self._lanes)
+        return {name: {"rate_per_min": round(l.bucket.rate * 60, 1),
+                       "waiting": l.bucket.waiting, "in_flight": l.in_flight,
+                       "breaker": l.breaker.state, **l.counts}
+                for name, l in lanes.items()}
+
+
+GOVERNOR = Governor()
+
+
+def _lane_gauge(field: str, value=lambda v: v):
+    def read():
+        return {tuple(name.split(":", 1)): value(lane[field]) for name, lane in GOVERNOR.stats().items()}
+    return read
+
+
+metrics.Gauge("storybook_api_in_flight", "xAI requests currently running, per model.",
+              ("kind", "model"), _lane_gauge("in_flight"))
+metrics.Gauge("storybook_api_waiting", "xAI requests queued for rate-limit tokens, per model.",
+              ("kind", "model"), _lane_gauge("waiting"))
+metrics.Gauge("storybook_api_rate_per_min", "Current adaptive request rate, per model.",
+              ("kind", "model"), _lane_gauge("rate_per_min"))
+metrics.Gauge("storybook_api_breaker_open", "1 while a model's circuit breaker is not closed.",
+              ("kind", "model"), _lane_gauge("breaker", lambda b: int(b != "closed")))
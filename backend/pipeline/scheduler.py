@@ -0,0 +1,169 @@
+"""
+pipeline/scheduler.py
+In-process job scheduler for the pipeline phases. Jobs wait in a priority
+queue (interactive work such as a single-page regen ahead of bulk
+generation) and start only while under the global and per-project
+concurrency limits, which the job store enforces across every worker process
+sharing it; a job held back by another process's work is retried every
+CLAIM_RETRY_SECONDS. Queue positions are published to the job store, and
+cancellation is cooperative: running phases stop at their next checkpoint.
+"""
+import bisect
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from . import metrics
+from .jobs import JobStore
+
+PRIORITY_INTERACTIVE = 0     # regen-page
+PRIORITY_NORMAL      = 1     # finalize
+PRIORITY_BULK        = 2     # generate-images
+
+MAX_RUNNING_JOBS     = int(os.environ.get("MAX_RUNNING_JOBS", "4"))
+MAX_JOBS_PER_PROJECT = int(os.environ.get("MAX_JOBS_PER_PROJECT", "2"))
+CLAIM_RETRY_SECONDS  = 2.0
+
+
+@dataclass(order=True)
+class _Task:
+    priority: int
+    seq: int
+    job_id: str = field(compare=False)
+    project_id: str = field(compare=False)
+    fn: Callable = field(compare=False)
+    args: tuple = field(compare=False)
+
+
+class Scheduler:
+    def __init__(self, jobs: JobStore, max_running: int = MAX_RUNNING_JOBS,
+                 max_per_project: int = MAX_JOBS_PER_PROJECT):
+        self.jobs            = jobs
+        self.max_running     = max(1, max_running)
+        self.max_per_project = max(1, max_per_project)
+        self._queue: List[_Task] = []
+        self._running: Dict[str, int] = {}
+        self._total = 0
+        self._seq   = itertools.count()
+        self._lock  = threading.Lock()
+        self._retry: Optional[threading.Timer] = None
+
+    def submit(self, job_id: str, project_id: str, priority: int, fn: Callable, *args):
+        """Queue fn(*args) for a job already created in the store with status 'queued'."""
+        task = _Task(priority, next(self._seq), job_id, project_id, fn, args)
+        with self._lock:
+            bisect.insort(self._queue, task)
+        self._pump()
+        self._publish_positions()
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job, or ask a running one to stop. False if it isn't active."""
+        with self._lock:
+            task = next((t for t in self._queue if t.job_id == job_id), None)
+            if task:
+                self._queue.remove(task)
+        if task:
+            self.jobs.append_log(job_id, "Cancelled before starting.")
+            self.jobs.update(job_id, status="cancelled", queue_position=None)
+            self._publish_positions()
+            return True
+        job = self.jobs.get(job_id, with_log=False)
+        if not job or job["status"] not in ("queued", "running"):
+            return False
+        # Running here or queued in another worker process: both check this flag
+        self.jobs.update(job_id, cancel_requested=True)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": len(self._queue), "running": self._total}
+
+    def _pump(self):
+        """
+        Start every queued task the limits allow, highest priority first. A task's
+        slot is reserved under _lock, but the store's claim (a write transaction that
+        can wait on other processes) runs outside it.
+        """
+        held_back = set()           # seqs whose claim failed this round
+        while True:
+            with self._lock:
+                task = self._reserve(held_back)
+            if task is None:
+                break
+            try:
+                claimed = self.jobs.claim(task.job_id, task.project_id,
+                                          self.max_running, self.max_per_project)
+            except BaseException:
+                self._release(task, requeue=True)
+                raise
+            if claimed:
+                threading.Thread(target=self._run, args=(task,),
+                                 name=f"job-{task.job_id}", daemon=True).start()
+            else:
+                # Slots are taken by jobs in other worker processes, which can't wake us
+                self._release(task, requeue=True)
+                held_back.add(task.seq)
+        if held_back:
+            with self._lock:
+                if self._retry is None:
+                    self._retry = threading.Timer(CLAIM_RETRY_SECONDS, self._repump)
+                    self._retry.daemon = True
+                    self._retry.start()
+
+    def _reserve(self, skip: set) -> Optional[_Task]:
+        """Take the first queued task within this process's limits, counted as running. Holds _lock."""
+        if self._total >= self.max_running:
+            return None
+        for i, task in enumerate(self._queue):
+            if task.seq in skip or self._running.get(task.project_id, 0) >= self.max_per_project:
+                continue
+            self._queue.pop(i)
+            self._total += 1
+            self._running[task.project_id] = self._running.get(task.project_id, 0) + 1
+            return task
+        return None
+
+    def _release(self, task: _Task, requeue: bool = False):
+        with self._lock:
+            self._total -= 1
+            self._running[task.project_id] -= 1
+            if not self._running[task.project_id]:
+                del self._running[task.project_id]
+            if requeue:
+                bisect.insort(self._queue, task)
+
+    def _repump(self):
+        with self._lock:
+            self._retry = None
+        self._pump()
+        self._publish_positions()
+
+    def _run(self, task: _Task):
+        try:
+            job = self.jobs.get(task.job_id, with_log=False)
+            if job and job.get("cancel_requested"):
+                self.jobs.append_log(task.job_id, "Cancelled before starting.")
+                self.jobs.update(task.job_id, status="cancelled", queue_position=None)
+            else:
+                self.jobs.update(task.job_id, queue_position=None)
+                start = time.monotonic()
+                try:
+                    task.fn(*task.args)
+                finally:
+                    job = self.jobs.get(task.job_id, with_log=False) or {}
+                    phase = job.get("phase", "")
+                    metrics.JOB_SECONDS.observe(time.monotonic() - start, phase=phase)
+                    metrics.JOBS_FINISHED.inc(phase=phase, status=job.get("status", ""))
+        finally:
+            self._release(task)
+            self._pump()
+            self._publish_positions()
+
+    def _publish_positions(self):
+        with self._lock:
+            queued = [t.job_id for t in self._queue]
+        for pos, job_id in enumerate(queued, 1):
+            self.jobs.update(job_id, queue_position=pos)
@@ -0,0 +1,54 @@
+"""
+pipeline/singleflight.py
+Coalesces concurrent identical calls: while one caller runs fn for a key, other
+callers with the same key wait for and share its result instead of repeating it.
+"""
+import threading
+from typing import Any, Callable, Dict
+
+from .jobs import JobCancelled
+
+
+class _Call:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.shared = 0
+        self._calls: Dict[str, _Call] = {}
+        self._lock  = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self.shared += 1
+            if leader:
+                try:
+                    call.result = fn()
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+                return call.result
+            call.done.wait()
+            # The leader's job being cancelled says nothing about ours: try again
+            if isinstance(call.error, JobCancelled):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+
+IN_FLIGHT = SingleFlight()
@@ -0,0 +1,112 @@
+"""
+pipeline/text.py
+Shared text layout for page overlays and title pages: a process-wide font
+cache keyed by (path, size), cached per-word advance widths so each line is
+measured once, a binary search for the largest font size that fits, and an
+outline mask built from a single rasterization of each line.
+"""
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+WIDTH_CACHE_WORDS = 4096     # per layout; 256 layouts stay bounded however varied the text
+
+
+class Layout:
+    """A loaded font plus the measurements wrapping needs, cached per word."""
+
+    def __init__(self, font):
+        self.font   = font
+        self.line_h = font.getbbox("Ag")[3]
+        self.space  = font.getlength(" ")
+        self._widths: Dict[str, float] = {}
+
+    def width(self, word: str) -> float:
+        w = self._widths.get(word)
+        if w is None:
+            if len(self._widths) >= WIDTH_CACHE_WORDS:
+                self._widths.clear()
+            w = self._widths[word] = self.font.getlength(word)
+        return w
+
+    def wrap(self, text: str, max_w: float) -> List[str]:
+        """Greedy word wrap; a single word wider than max_w keeps a line to itself."""
+        lines: List[str] = []
+        cur: List[str] = []
+        cur_w = 0.0
+        for word in text.split():
+            ww = self.width(word)
+            new_w = cur_w + self.space + ww if cur else ww
+            if cur and new_w > max_w:
+                lines.append(" ".join(cur))
+                cur, cur_w = [word], ww
+            else:
+                cur.append(word)
+                cur_w = new_w
+        if cur:
+            lines.append(" ".join(cur))
+        return lines
+
+
+@lru_cache(maxsize=256)
+def layout(path: str, size: int) -> Layout:
+    return Layout(ImageFont.truetype(path, size))
+
+
+@lru_cache(maxsize=1)
+def default_layout() -> Layout:
+    return Layout(ImageFont.load_default())
+
+
+def fit(sizes: Sequence[int], paths: Sequence[str],
+        accept: Callable[[Layout], Optional[List[str]]]) -> Optional[Tuple[Layout, List[str]]]:
+    """
+    Largest size in `sizes` (descending) at which some font in `paths` is accepted.
+    `accept` returns the wrapped lines when a layout fits, or None. Fitting is
+    assumed monotone in size, so this binary-searches instead of scanning.
+    """
+    def attempt(size: int):
+        for p in paths:
+            try:
+                lay = layout(p, size)
+            except OSError:
+                continue
+            lines = accept(lay)
+            if lines is not None:
+                return lay, lines
+        return None
+
+    best = None
+    lo, hi = 0, len(sizes) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        found = attempt(sizes[mid])
+        if found:
+            best, hi = found, mid - 1
+        else:
+            lo = mid + 1
+    return best
+
+
+def outline_mask(font, text: str, radius: int, step: int = 2):
+    """
+    Coverage of `text` drawn at every (dx, dy) in a square of `radius` (in `step`
+    increments, skipping the origin), as one L mask. The glyphs are rasterized
+    once and shifted copies are screen-composited, which is what repeatedly
+    blending the same ink at each offset produces. Returns the mask and its
+    top-left corner relative to the text origin.
+    """
+    l, t, r, b = font.getbbox(text)
+    glyph = Image.new("L", (max(1, r - l), max(1, b - t)), 0)
+    ImageDraw.Draw(glyph).text((-l, -t), text, font=font, fill=255)
+
+    gw, gh = glyph.size
+    mask = Image.new("L", (gw + 2 * radius, gh + 2 * radius), 0)
+    for dx in range(-radius, radius + 1, step):
+        for dy in range(-radius, radius + 1, step):
+            if dx == 0 and dy == 0:
+                continue
+            box = (radius + dx, radius + dy, radius + dx + gw, radius + dy + gh)
+            mask.paste(ImageChops.screen(mask.crop(box), glyph), box)
+    return mask, (l - radius, t - radius)
@@ -0,0 +1,80 @@
+"""
+pipeline/thumbs.py
+On-demand thumbnails of project images, kept under .cache/thumbs. Each file's
+name carries the source's mtime and size, so a regenerated page never serves
+an old thumbnail; invalidate() removes the stale ones once the pipeline
+rewrites a page.
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from . import cpu
+from .cache import content_key
+from .singleflight import IN_FLIGHT
+
+THUMB_WIDTHS  = (128, 256, 384, 512, 768)     # requested widths snap up to one of these
+THUMB_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"),
+                 "png": ("PNG", "image/png")}
+THUMB_QUALITY = 80
+THUMB_SOURCES = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+def _dir(proj: Path, rel: str) -> Path:
+    return proj / ".cache" / "thumbs" / content_key(rel)[:24]
+
+
+def snap_width(w: int) -> int:
+    return next((t for t in THUMB_WIDTHS if t >= w), THUMB_WIDTHS[-1])
+
+
+def thumbnail(proj: Path, rel: str, width: int, fmt: str) -> Path:
+    """Path of a `fmt` thumbnail of proj/rel at (snapped) `width`, rendering it if needed."""
+    src = proj / rel
+    st = src.stat()
+    width = snap_width(width)
+    out = _dir(proj, rel) / f"{st.st_mtime_ns:x}-{st.st_size:x}-{width}.{fmt}"
+    if out.exists():
+        return out
+
+    def render():
+        if not out.exists():
+            out.parent.mkdir(parents=True, exist_ok=True)
+            cpu.run(_render, src, out, width, THUMB_FORMATS[fmt][0])
+        return out
+
+    return IN_FLIGHT.do(content_key("thumb", str(out)), render)
+
+
+def _render(src: Path, out: Path, width: int, pil_fmt: str):
+    """Decode, resize and encode in a CPU pool worker; the file is the only result."""
+    with Image.open(src) as im:
+        im.draft("RGB", (width, width * 4))
+        if pil_fmt == "JPEG" or im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGB" if pil_fmt == "JPEG" else "RGBA")
+        if im.width > width:
+            im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".part")
+        opts = {"method": 4} if pil_fmt == "WEBP" else {"optimize": True}
+        with os.fdopen(fd, "wb") as f:
+            im.save(f, pil_fmt, quality=THUMB_QUALITY, **opts)
+    os.replace(tmp, out)
+
+
+def invalidate(proj: Path, rel: str):
+    """Drop thumbnails of proj/rel rendered from anything but its current contents."""
+    d = _dir(proj, rel)
+    if not d.exists():
+        return
+    try:
+        st = (proj / rel).stat()
+    except FileNotFoundError:
+        shutil.rmtree(d, ignore_errors=True)
+        return
+    keep = f"{st.st_mtime_ns:x}-{st.st_size:x}-"
+    for p in d.iterdir():
+        if not p.name.startswith(keep):
+            p.unlink(missing_ok=True)
@@ -0,0 +1,84 @@
+import os
+import time
+
+from pipeline import artifacts
+from pipeline.artifacts import ArtifactIndex
+
+
+def make_project(root, name, pages=2):
+    proj = root / name
+    (proj / "generated_images").mkdir(parents=True)
+    for i in range(1, pages + 1):
+        (proj / "generated_images" / f"page_{i}.png").write_bytes(b"png%d" % i)
+    return proj
+
+
+def paths(index, project_id):
+    return [a["path"] for a in index.artifacts(project_id)]
+
+
+# ── Backfill ─────────────────────────────────────────────────────────────────
+def test_backfill_scans_everything_once_then_only_new_projects(tmp_path, monkeypatch):
+    make_project(tmp_path, "old")
+    first, second = ArtifactIndex(tmp_path), ArtifactIndex(tmp_path)   # two workers
+    scanned = []
+    real_scan = ArtifactIndex.scan
+    monkeypatch.setattr(ArtifactIndex, "scan",
+                        lambda self, pid, proj: (scanned.append(pid), real_scan(self, pid, proj)))
+    first.backfill()
+    make_project(tmp_path, "later")
+    second.backfill()
+    assert scanned == ["old", "later"]
+    assert paths(second, "later") == ["generated_images/page_1.png", "generated_images/page_2.png"]
+
+
+# ── Refresh on read ──────────────────────────────────────────────────────────
+def test_refresh_indexes_a_project_copied_in_later(tmp_path):
+    index = ArtifactIndex(tmp_path)
+    index.backfill()
+    proj = make_project(tmp_path, "copied", pages=3)
+    index.refresh("copied", proj)
+    assert len(paths(index, "copied")) == 3
+
+
+def test_refresh_picks_up_a_write_the_index_missed(tmp_path):
+    index = ArtifactIndex(tmp_path)
+    proj = make_project(tmp_path, "p")
+    index.refresh("p", proj)
+    time.sleep(0.01)
+    (proj / "final_video.mp4").write_bytes(b"mp4")          # never recorded
+    index.refresh("p", proj)
+    assert "final_video.mp4" in paths(index, "p")
+
+
+def test_refresh_leaves_a_current_project_alone(tmp_path, monkeypatch):
+    index = ArtifactIndex(tmp_path)
+    proj = make_project(tmp_path, "p")
+    index.refresh("p", proj)
+    monkeypatch.setattr(ArtifactIndex, "scan", lambda *a: (_ for _ in ()).throw(AssertionError))
+    index.refresh("p", proj)
+
+
+def test_scan_keeps_traces_and_skips_unchanged_files(tmp_path, monkeypatch):
+    index = ArtifactIndex(tmp_path)
+    proj = make_project(tmp_path, "p")
+    (proj / "traces").mkdir()
+    (proj / "traces" / "job.json").write_text("{}")
+    index.scan("p", proj)
+    hashed = []
+    monkeypatch.setattr(artifacts, "file_digest", lambda path: hashed.append(path) or "x" * 64)
+    os.utime(proj / "generated_images" / "page_2.png", (time.time() + 5,) * 2)
+    index.scan("p", proj)
+    assert "traces/job.json" in paths(index, "p")
+    assert hashed == [proj / "generated_images" / "page_2.png"]
+
+
+# ── Versions ─────────────────────────────────────────────────────────────────
+def test_current_version_is_none_once_the_file_changes(tmp_path):
+    index = ArtifactIndex(tmp_path)
+    proj = make_project(tmp_path, "p")
+    rel, path = "generated_images/page_1.png", proj / "generated_images" / "page_1.png"
+    sha = index.record("p", proj, rel, "images")
+    assert index.current_version("p", rel, path.stat()) == artifacts.version(sha)
+    path.write_bytes(b"rewritten")
+    assert index.current_version("p", rel, path.stat()) is None
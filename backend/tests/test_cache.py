@@ -0,0 +1,34 @@
+import os
+
+from pipeline.cache import JsonCache, trim_dir
+
+
+# ── JsonCache ────────────────────────────────────────────────────────────────
+def test_writers_sharing_a_file_keep_each_others_entries(tmp_path):
+    path = tmp_path / "rewrite.json"
+    a, b = JsonCache(path), JsonCache(path)
+    a.put("one", 1)
+    b.put("two", 2)
+    a.put_many({"three": 3})
+    fresh = JsonCache(path)
+    assert (fresh.get("one"), fresh.get("two"), fresh.get("three")) == (1, 2, 3)
+    assert a.get("two") == 2
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = JsonCache(tmp_path / "c.json", max_entries=2)
+    cache.put("old", 1)
+    cache.put("mid", 2)
+    cache.get("old")
+    cache.put("new", 3)
+    assert "mid" not in cache and "old" in cache and "new" in cache
+
+
+# ── trim_dir ─────────────────────────────────────────────────────────────────
+def test_trim_dir_drops_least_recently_modified_files_of_the_suffix(tmp_path):
+    for i, name in enumerate(("a.png", "b.png", "c.png", "d.tmp")):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (1000 + i, 1000 + i))
+    os.utime(tmp_path / "a.png", (2000, 2000))                 # used most recently
+    trim_dir(tmp_path, 250, ".png")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.png", "c.png", "d.tmp"]
@@ -0,0 +1,68 @@
+import gzip
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pipeline import download
+
+BODY = os.urandom(64 * 1024) + b"a" * 256 * 1024         # compresses well, but not to nothing
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download.time, "sleep", lambda s: None)
+    monkeypatch.setattr(download, "DOWNLOAD_CHUNK", 1024)
+    seen, state = [], {"calls": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            state["calls"] += 1
+            seen.append(dict(self.headers))
+            if self.path == "/gzip":
+                # Ignores Accept-Encoding; the first response is cut off half way
+                payload = gzip.compress(BODY)
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload[:len(payload) // 2] if state["calls"] == 1 else payload)
+                return
+            start = int(self.headers.get("Range", "bytes=0-")[6:].rstrip("-"))
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Length", str(len(BODY) - start))
+            self.end_headers()
+            end = len(BODY) // 2 if state["calls"] == 1 else len(BODY)
+            self.wfile.write(BODY[start:end])
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", seen
+    httpd.shutdown()
+
+
+def test_resumes_from_the_bytes_on_the_wire(server, tmp_path):
+    url, seen = server
+    st = download.fetch(f"{url}/plain", tmp_path / "a.png")
+    assert (tmp_path / "a.png").read_bytes() == BODY and st["resumes"] == 1
+    assert seen[0]["Accept-Encoding"] == "identity"
+    assert seen[1]["Range"] == f"bytes={len(BODY) // 2}-"
+
+
+def test_compressed_response_restarts_instead_of_resuming(server, tmp_path):
+    url, seen = server
+    download.fetch(f"{url}/gzip", tmp_path / "a.png")
+    assert (tmp_path / "a.png").read_bytes() == BODY
+    assert "Range" not in seen[1]
+
+
+def test_downloads_get_the_usual_file_mode(server, tmp_path):
+    url, _ = server
+    download.fetch(f"{url}/plain", tmp_path / "a.png")
+    umask = os.umask(0)
+    os.umask(umask)
+    assert (tmp_path / "a.png").stat().st_mode & 0o777 == 0o644 & ~umask
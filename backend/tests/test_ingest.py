@@ -0,0 +1,33 @@
+import os
+
+from pipeline import ingest
+
+
+def upload(proj, content: bytes, dest):
+    tmp = ingest.blob_dir(proj) / "upload.part"
+    tmp.write_bytes(content)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    return ingest.store(proj, tmp, content.hex(), dest)
+
+
+def blobs(proj):
+    return sorted(p.name for p in ingest.blob_dir(proj).iterdir() if not p.name.startswith("."))
+
+
+# ── Blob store ───────────────────────────────────────────────────────────────
+def test_reupload_deletes_the_blob_nothing_links_to(tmp_path):
+    dest = tmp_path / "assets" / "characters" / "rex.png"
+    assert not upload(tmp_path, b"v1", dest)
+    upload(tmp_path, b"v2", dest)
+    assert blobs(tmp_path) == ["7632.png"]
+    assert dest.read_bytes() == b"v2"
+
+
+def test_reupload_keeps_a_blob_another_name_links_to(tmp_path):
+    rex  = tmp_path / "assets" / "characters" / "rex.png"
+    dino = tmp_path / "assets" / "characters" / "dino.png"
+    upload(tmp_path, b"v1", rex)
+    assert upload(tmp_path, b"v1", dino)
+    upload(tmp_path, b"v2", rex)
+    assert blobs(tmp_path) == ["7631.png", "7632.png"]
+    assert os.path.samefile(dino, ingest.blob_dir(tmp_path) / "7631.png")
@@ -0,0 +1,27 @@
+import pytest
+
+from pipeline.jobs import MemoryJobStore, SqliteJobStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def jobs(request, tmp_path):
+    return MemoryJobStore() if request.param == "memory" else SqliteJobStore(tmp_path / "jobs.db")
+
+
+# ── Ready pages ──────────────────────────────────────────────────────────────
+def test_get_without_ready_reports_its_length(jobs):
+    jobs.create("j", "p", phase="images")
+    assert jobs.get("j", with_log=False, with_ready=False)["ready_count"] == 0
+    jobs.update("j", ready=[{"page": 1}, {"page": 2}])
+    job = jobs.get("j", with_log=False, with_ready=False)
+    assert job["ready_count"] == 2 and "ready" not in job and job["phase"] == "images"
+    assert jobs.get("j", with_log=False)["ready"] == [{"page": 1}, {"page": 2}]
+
+
+def test_ready_since_returns_the_tail(jobs):
+    jobs.create("j", "p")
+    assert jobs.ready_since("j", 0) == []
+    jobs.update("j", ready=[{"page": 0}, {"page": 1}, {"page": 2}])
+    assert jobs.ready_since("j", 1) == [{"page": 1}, {"page": 2}]
+    assert jobs.ready_since("j", 3) == []
+    assert jobs.ready_since("missing", 0) == []
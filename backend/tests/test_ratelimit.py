@@ -0,0 +1,180 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import ratelimit
+from pipeline.jobs import JobCancelled
+from pipeline.ratelimit import Breaker, CircuitOpen, Governor, classify, retry_hint
+
+
+class GrpcError(Exception):
+    def __init__(self, code: str, msg: str = "", trailers=()):
+        super().__init__(msg)
+        self._code, self._trailers = code, trailers
+
+    def code(self):
+        return SimpleNamespace(name=self._code)
+
+    def trailing_metadata(self):
+        return self._trailers
+
+
+def open_breaker() -> Breaker:
+    b = Breaker()
+    for _ in range(ratelimit.BREAKER_FAILURES):
+        b.record(False)
+    return b
+
+
+# ── Breaker ──────────────────────────────────────────────────────────────────
+def test_breaker_opens_after_consecutive_failures():
+    b = Breaker()
+    for _ in range(ratelimit.BREAKER_FAILURES - 1):
+        b.record(False)
+    assert b.state == "closed" and b.allow()
+    b.record(False)
+    assert b.state == "open"
+    assert not b.allow()
+
+
+def test_breaker_success_resets_failure_count():
+    b = Breaker()
+    for _ in range(ratelimit.BREAKER_FAILURES - 1):
+        b.record(False)
+    b.record(True)
+    b.record(False)
+    assert b.state == "closed"
+
+
+def test_half_open_allows_one_probe(monkeypatch):
+    b = open_breaker()
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    assert b.state == "half-open"
+    assert b.allow()
+    assert not b.allow()
+
+
+def test_probe_outcome_closes_or_reopens(monkeypatch):
+    b = open_breaker()
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    assert b.allow()
+    b.record(False)                        # a failed probe re-opens straight away
+    assert b.opened_at is not None and not b.probing
+    assert b.allow()
+    b.record(True)
+    assert b.state == "closed" and b.failures == 0
+
+
+def test_abandoned_probe_lets_the_next_call_probe(monkeypatch):
+    b = open_breaker()
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    assert b.allow()
+    b.abandon()
+    assert b.state == "half-open" and b.allow()
+
+
+def test_abandon_from_another_thread_keeps_the_probe(monkeypatch):
+    b = open_breaker()
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    assert b.allow()
+    t = threading.Thread(target=b.abandon)
+    t.start()
+    t.join()
+    assert not b.allow()
+
+
+# ── Governor ─────────────────────────────────────────────────────────────────
+def cancel():
+    raise JobCancelled()
+
+
+def test_cancel_while_waiting_for_a_token_releases_the_probe(monkeypatch):
+    gov = Governor()
+    lane = gov._lane("image", "m")
+    for _ in range(ratelimit.BREAKER_FAILURES):
+        lane.breaker.record(False)
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    lane.bucket.tokens = 0                 # the probe has to wait, and is cancelled meanwhile
+    with pytest.raises(JobCancelled):
+        gov.call("image", "m", "acct", lambda: "ok", checkpoint=cancel)
+    assert not lane.breaker.probing
+    lane.bucket.tokens = lane.bucket.burst
+    assert gov.call("image", "m", "acct", lambda: "ok") == "ok"
+    assert lane.breaker.state == "closed"
+
+
+def test_cancel_from_the_call_does_not_close_the_breaker(monkeypatch):
+    gov = Governor()
+    lane = gov._lane("image", "m")
+    for _ in range(ratelimit.BREAKER_FAILURES):
+        lane.breaker.record(False)
+    monkeypatch.setattr(ratelimit, "BREAKER_COOLDOWN", 0)
+    with pytest.raises(JobCancelled):
+        gov.call("image", "m", "acct", cancel)
+    assert lane.breaker.opened_at is not None and not lane.breaker.probing
+
+
+def test_open_breaker_sheds_calls():
+    gov = Governor()
+    lane = gov._lane("image", "m")
+    for _ in range(ratelimit.BREAKER_FAILURES):
+        lane.breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        gov.call("image", "m", "acct", lambda: "ok")
+    assert lane.counts["shed"] == 1
+
+
+def test_fatal_errors_are_not_retried(monkeypatch):
+    gov, calls = Governor(), []
+
+    def fn():
+        calls.append(1)
+        raise GrpcError("INVALID_ARGUMENT")
+    with pytest.raises(GrpcError):
+        gov.call("chat", "m", "acct", fn)
+    assert len(calls) == 1
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_sleep", lambda seconds, checkpoint: None)
+    gov, calls = Governor(), []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise GrpcError("UNAVAILABLE")
+        return "ok"
+    assert gov.call("chat", "m", "acct", fn) == "ok"
+    assert len(calls) == 3
+
+
+# ── classify / retry_hint ────────────────────────────────────────────────────
+@pytest.mark.parametrize("error, expected", [
+    (GrpcError("RESOURCE_EXHAUSTED"), "throttle"),
+    (GrpcError("PERMISSION_DENIED"), "fatal"),
+    (GrpcError("INVALID_ARGUMENT"), "fatal"),
+    (GrpcError("UNAVAILABLE"), "transient"),
+    (SimpleNamespace(status_code=429), "throttle"),
+    (SimpleNamespace(response=SimpleNamespace(status_code=404)), "fatal"),
+    (SimpleNamespace(response=SimpleNamespace(status_code=503)), "transient"),
+    (RuntimeError("Rate limit exceeded"), "throttle"),
+    (RuntimeError("Too Many Requests"), "throttle"),
+    (ConnectionError("reset by peer"), "transient"),
+])
+def test_classify(error, expected):
+    assert classify(error) == expected
+
+
+def test_retry_hint_sources():
+    assert retry_hint(SimpleNamespace(retry_after="3")) == 3.0
+    assert retry_hint(GrpcError("RESOURCE_EXHAUSTED", trailers=[("Retry-After", "7")])) == 7.0
+    assert retry_hint(SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "2.5"}))) == 2.5
+    assert retry_hint(RuntimeError("quota hit, retry after 12s")) == 12.0
+    assert retry_hint(RuntimeError("Retry in 0.5 s")) == 0.5
+
+
+def test_retry_hint_ignores_junk():
+    assert retry_hint(RuntimeError("no hint here")) is None
+    assert retry_hint(SimpleNamespace(retry_after="soon")) is None
+    assert retry_hint(SimpleNamespace(retry_after="-4")) == 0.0
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import scheduler as scheduler_mod
+from pipeline.jobs import MemoryJobStore, SqliteJobStore
+from pipeline.scheduler import PRIORITY_NORMAL, Scheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(scheduler_mod, "CLAIM_RETRY_SECONDS", 0.05)
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def submit(sched, jobs, job_id, project_id, release: threading.Event, started: list):
+    def work(*_):
+        started.append(job_id)
+        release.wait(5)
+        jobs.update(job_id, status="done")
+    jobs.create(job_id, project_id, status="queued")
+    sched.submit(job_id, project_id, PRIORITY_NORMAL, work)
+
+
+# ── Limits across worker processes ───────────────────────────────────────────
+def test_global_cap_holds_across_schedulers_sharing_a_store(tmp_path):
+    jobs = SqliteJobStore(tmp_path / "jobs.db")
+    a, b = Scheduler(jobs, max_running=2, max_per_project=2), Scheduler(jobs, max_running=2, max_per_project=2)
+    release, started = threading.Event(), []
+    submit(a, jobs, "a1", "p1", release, started)
+    submit(a, jobs, "a2", "p2", release, started)
+    wait_for(lambda: len(started) == 2)
+    submit(b, jobs, "b1", "p3", release, started)
+    time.sleep(0.2)
+    assert sorted(started) == ["a1", "a2"]
+    assert jobs.get("b1", with_log=False)["status"] == "queued"
+    release.set()
+    wait_for(lambda: jobs.get("b1", with_log=False)["status"] == "done")
+
+
+def test_project_cap_holds_across_schedulers_sharing_a_store(tmp_path):
+    jobs = SqliteJobStore(tmp_path / "jobs.db")
+    a, b = Scheduler(jobs, max_running=4, max_per_project=1), Scheduler(jobs, max_running=4, max_per_project=1)
+    release, started = threading.Event(), []
+    submit(a, jobs, "a1", "p1", release, started)
+    wait_for(lambda: started == ["a1"])
+    submit(b, jobs, "b1", "p1", release, started)
+    submit(b, jobs, "b2", "p2", release, started)
+    wait_for(lambda: "b2" in started)
+    assert "b1" not in started
+    release.set()
+    wait_for(lambda: jobs.get("b1", with_log=False)["status"] == "done")
+
+
+def test_memory_store_claim_respects_caps():
+    jobs = MemoryJobStore()
+    for job_id, project_id in (("j1", "p1"), ("j2", "p1"), ("j3", "p2")):
+        jobs.create(job_id, project_id, status="queued")
+    assert jobs.claim("j1", "p1", 2, 1)
+    assert not jobs.claim("j2", "p1", 2, 1)
+    assert jobs.claim("j3", "p2", 2, 1)
+    assert jobs.get("j2", with_log=False)["status"] == "queued"
+
+
+def test_a_slow_claim_does_not_hold_the_scheduler_lock():
+    class SlowStore(MemoryJobStore):
+        def claim(self, *args):
+            entered.set()
+            release.wait(5)
+            return super().claim(*args)
+
+    entered, release = threading.Event(), threading.Event()
+    jobs = SlowStore()
+    sched = Scheduler(jobs)
+    jobs.create("j", "p", status="queued")
+    threading.Thread(target=sched.submit, args=("j", "p", PRIORITY_NORMAL, lambda *_: None),
+                     daemon=True).start()
+    assert entered.wait(5)
+    done = threading.Event()
+    threading.Thread(target=lambda: (sched.stats(), done.set()), daemon=True).start()
+    assert done.wait(1), "stats() waited on the store's claim"
+    release.set()
+    wait_for(lambda: sched.stats() == {"queued": 0, "running": 0})
@@ -0,0 +1,62 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from pipeline import text
+from pipeline.compose import TITLE_FONTS
+
+INK = (0, 0, 0, 220)
+# 8-bit rounding of one screen composite vs blending each offset in turn grows
+# with the number of offsets: 2 at radius 4, 5 at radius 14. 8 is ~3%, invisible.
+MAX_CHANNEL_DIFF = 8
+MAX_DIFF_SHARE   = 0.05     # of the outline's inked pixels that may differ at all
+
+
+def load_font(size: int):
+    for fp in TITLE_FONTS + ["/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"]:
+        try:
+            return ImageFont.truetype(fp, size)
+        except OSError:
+            continue
+    pytest.skip("no TrueType font available")
+
+
+def draw_each_offset(size, font, line, x, y, r):
+    """The renderer outline_mask replaced: draw.text once per offset."""
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for dx in range(-r, r + 1, 2):
+        for dy in range(-r, r + 1, 2):
+            if dx or dy:
+                draw.text((x + dx, y + dy), line, font=font, fill=INK)
+    return overlay
+
+
+def paste_mask(size, font, line, x, y, r):
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    mask, (ox, oy) = text.outline_mask(font, line, r, 2)
+    overlay.paste(INK, (x + ox, y + oy), mask)
+    return overlay
+
+
+# ── outline_mask ─────────────────────────────────────────────────────────────
+@pytest.mark.parametrize("px", [32, 48, 72, 92, 124])      # compose's title sizes span ~32–123px
+def test_outline_mask_matches_drawing_each_offset(px):
+    font = load_font(px)
+    r    = max(4, int((font.getbbox("Ag")[3] + 20) * 0.09))   # as compose.render_title
+    args = ((900, 400), font, "Dinosaur Adventure", 40, 60, r)
+    old, new = draw_each_offset(*args), paste_mask(*args)
+    diff = ImageChops.difference(old, new)
+    assert max(hi for _, hi in diff.getextrema()) <= MAX_CHANNEL_DIFF
+    inked   = sum(old.getchannel("A").histogram()[1:])
+    differs = sum(diff.getchannel("A").histogram()[1:])
+    assert differs <= inked * MAX_DIFF_SHARE
+
+
+
+# ── Layout ───────────────────────────────────────────────────────────────────
+def test_width_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(text, "WIDTH_CACHE_WORDS", 10)
+    lay = text.Layout(ImageFont.load_default())
+    for i in range(25):
+        assert lay.width(f"w{i}") == lay.font.getlength(f"w{i}")
+    assert len(lay._widths) <= 10
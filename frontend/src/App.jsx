@@ -16,20 +16,31 @@ const API = {
       body: JSON.stringify(data),
     }).then(r => r.json())
   },
-  async generateImages(pid) {
-    return fetch(`/api/projects/${pid}/generate-images`, { method: 'POST' }).then(r => r.json())
+  async generateImages(pid, resume=false) {
+    return fetch(`/api/projects/${pid}/generate-images${resume?'?resume=true':''}`, { method: 'POST' }).then(r => r.json())
   },
-  async regenPage(pid, pageIndex, extraInstruction) {
+  async regenPage(pid, pageIndex, extraInstruction, refreshBackground=false) {
     const fd = new FormData()
     fd.append('page_index', pageIndex)
     fd.append('extra_instruction', extraInstruction || '')
+    fd.append('refresh_background', refreshBackground ? 'true' : 'false')
     return fetch(`/api/projects/${pid}/regen-page`, { method: 'POST', body: fd }).then(r => r.json())
   },
   async finalize(pid) {
     return fetch(`/api/projects/${pid}/finalize`, { method: 'POST' }).then(r => r.json())
   },
-  async pollJob(jid) {
-    return fetch(`/api/jobs/${jid}`).then(r => r.json())
+  async cancelJob(jid) {
+    return fetch(`/api/jobs/${jid}/cancel`, { method: 'POST' }).then(r => r.json())
+  },
+  // Server-pushed job updates; returns a function that closes the stream
+  watchJob(jid, { onLog, onProgress, onQueue, onPage, onStatus }) {
+    const es = new EventSource(`/api/jobs/${jid}/events`)
+    es.addEventListener('log',      e => onLog?.(JSON.parse(e.data).msg))
+    es.addEventListener('progress', e => onProgress?.(JSON.parse(e.data).progress))
+    es.addEventListener('queue',    e => onQueue?.(JSON.parse(e.data).position))
+    es.addEventListener('page',     e => onPage?.(JSON.parse(e.data)))
+    es.addEventListener('status',   e => { es.close(); onStatus?.(JSON.parse(e.data)) })
+    return () => es.close()
   },
   async getOutputs(pid) {
     return fetch(`/api/projects/${pid}/outputs`).then(r => r.json())
@@ -165,31 +176,29 @@ function ProgressBar({ pct, error }) {
 function ReviewScreen({ projectId, outputs, onFinalize, finalJobData, finalOutputs }) {
   const [regenJobs, setRegenJobs]       = useState({})
   const [instructions, setInstructions] = useState({})
+  const [newBackground, setNewBackground] = useState({})
   const [finalizing, setFinalizing]     = useState(false)
+  const streams = useRef({})
 
   const allPages = [
     ...(outputs.title ? [{ key:'title', label:'Title Page', src:outputs.title, index:0 }] : []),
     ...(outputs.images||[]).map((src,i) => ({ key:`page_${i+1}`, label:`Page ${i+1}`, src, index:i+1 })),
   ]
 
-  useEffect(() => {
-    const active = Object.entries(regenJobs).filter(([,j]) => j.status==='running')
-    if (active.length===0) return
-    const tid = setInterval(async () => {
-      const updates = {}
-      for (const [key,job] of active) {
-        const d = await API.pollJob(job.jobId)
-        updates[key] = { ...job, status:d.status, log:d.log, progress:d.progress }
-      }
-      setRegenJobs(prev => ({ ...prev, ...updates }))
-    }, 2000)
-    return () => clearInterval(tid)
-  }, [regenJobs])
+  useEffect(() => () => Object.values(streams.current).forEach(close => close()), [])
 
   const handleRegen = async (page) => {
     const instruction = instructions[page.key] || ''
-    const { job_id } = await API.regenPage(projectId, page.index, instruction)
-    setRegenJobs(prev => ({ ...prev, [page.key]: { jobId:job_id, status:'running', log:[], progress:0 } }))
+    const { job_id } = await API.regenPage(projectId, page.index, instruction, !!newBackground[page.key])
+    const update = patch => setRegenJobs(prev => ({ ...prev, [page.key]: { ...prev[page.key], ...patch(prev[page.key]) } }))
+    setRegenJobs(prev => ({ ...prev, [page.key]: { jobId:job_id, status:'running', log:[], progress:0, src:prev[page.key]?.src } }))
+    streams.current[page.key]?.()
+    streams.current[page.key] = API.watchJob(job_id, {
+      onLog:      l  => update(j => ({ log:[...j.log, l] })),
+      onProgress: p  => update(() => ({ progress:p })),
+      onPage:     pg => update(() => ({ src:pg.url })),
+      onStatus:   st => { delete streams.current[page.key]; update(() => st) },
+    })
   }
 
   const handleFinalize = async () => { setFinalizing(true); onFinalize() }
@@ -218,7 +227,8 @@ function ReviewScreen({ projectId, outputs, onFinalize, finalJobData, finalOutpu
           <div style={{display:'flex',justifyContent:'space-between',marginBottom:10}}>
             <span style={{fontFamily:'Cinzel,serif',fontSize:14,
               color:finalJobData.status==='done'?'var(--gold)':finalJobData.status==='error'?'#ff6b6b':'var(--parchment)'}}>
-              {finalJobData.status==='done'?'✨ Done!':finalJobData.status==='error'?'⚠ Error':'⏳ Building…'}
+              {finalJobData.status==='done'?'✨ Done!':finalJobData.status==='error'?'⚠ Error'
+                :finalJobData.status==='cancelled'?'Cancelled':finalJobData.queue?`⏳ Queued — position ${finalJobData.queue}`:'⏳ Building…'}
             </span>
             <span style={{fontFamily:'Cinzel,serif',fontSize:13,color:'var(--gold-light)'}}>{finalJobData.progress||0}%</span>
           </div>
@@ -241,7 +251,7 @@ function ReviewScreen({ projectId, outputs, onFinalize, finalJobData, finalOutpu
         {allPages.map(page => {
           const job = regenJobs[page.key]
           const running = job?.status==='running'
-          const imgSrc = job?.status==='done' ? `${page.src}?v=${Date.now()}` : page.src
+          const imgSrc = job?.src || page.src
           return (
             <Card key={page.key} style={{padding:16,display:'flex',flexDirection:'column',gap:12}}>
               <div style={{fontFamily:'Cinzel,serif',fontSize:13,color:'var(--gold)',letterSpacing:'0.06em'}}>{page.label}</div>
@@ -257,6 +267,13 @@ function ReviewScreen({ projectId, outputs, onFinalize, finalJobData, finalOutpu
               <div style={{display:'flex',flexDirection:'column',gap:8}}>
                 <Textarea value={instructions[page.key]||''} onChange={v=>setInstructions(prev=>({...prev,[page.key]:v}))}
                   placeholder="Optional: describe what to change (e.g. 'make the sky darker', 'add more trees')" rows={2} />
+                {page.index>0 && (
+                  <label style={{display:'flex',alignItems:'center',gap:6,fontSize:13,color:'var(--text-muted)',cursor:'pointer'}}>
+                    <input type="checkbox" checked={!!newBackground[page.key]}
+                      onChange={e=>setNewBackground(prev=>({...prev,[page.key]:e.target.checked}))} />
+                    Paint a new background
+                  </label>
+                )}
                 <Btn variant="amber" small onClick={()=>handleRegen(page)} disabled={running||finalizing}>
                   {running?'⏳ Regenerating…':'🔄 Regenerate This Page'}
                 </Btn>
@@ -324,35 +341,42 @@ export default function App() {
 
   useEffect(() => {
     if (!jobId || phase!=='generating') return
-    const tid = setInterval(async () => {
-      const d = await API.pollJob(jobId)
-      setJobData(d)
-      if (d.status==='review') {
-        clearInterval(tid)
-        const outs = await API.getOutputs(projectId)
-        setOutputs(outs); setPhase('review')
-      } else if (d.status==='error') {
-        clearInterval(tid); setPhase('form'); setSubmitting(false)
-      }
-    }, 3000)
-    return () => clearInterval(tid)
+    return API.watchJob(jobId, {
+      onLog:      l  => setJobData(d => ({ ...d, log:[...(d?.log||[]), l] })),
+      onProgress: p  => setJobData(d => ({ ...d, progress:p })),
+      onQueue:    q  => setJobData(d => ({ ...d, queue:q })),
+      onPage:     pg => setJobData(d => ({ ...d, pages:{ ...(d?.pages||{}), [pg.page]:pg.url } })),
+      onStatus:   async st => {
+        setJobData(d => ({ ...d, ...st }))
+        if (st.status==='review') {
+          const outs = await API.getOutputs(projectId)
+          setOutputs(outs); setPhase('review')
+        } else {
+          setPhase('form'); setSubmitting(false)
+        }
+      },
+    })
   }, [jobId, phase, projectId])
 
   useEffect(() => {
     if (!finalJobId) return
-    const tid = setInterval(async () => {
-      const d = await API.pollJob(finalJobId)
-      setFinalJobData(d)
-      if (d.status==='done') {
-        clearInterval(tid)
-        const outs = await API.getOutputs(projectId)
-        setFinalOutputs(outs)
-      } else if (d.status==='error') { clearInterval(tid) }
-    }, 3000)
-    return () => clearInterval(tid)
+    return API.watchJob(finalJobId, {
+      onLog:      l => setFinalJobData(d => ({ ...d, log:[...(d?.log||[]), l] })),
+      onProgress: p => setFinalJobData(d => ({ ...d, progress:p })),
+      onQueue:    q => setFinalJobData(d => ({ ...d, queue:q })),
+      onStatus:   async st => {
+        setFinalJobData(d => ({ ...d, ...st }))
+        if (st.status==='done') {
+          const outs = await API.getOutputs(projectId)
+          setFinalOutputs(outs)
+        }
+      },
+    })
   }, [finalJobId, projectId])
 
   const ext = f => f?.name?.slice(f.name.lastIndexOf('.')) || '.png'
+  // After a failed or cancelled run, keep the pages that were already made
+  const canResume = ['error','cancelled'].includes(jobData?.status)
 
   const handleGenerate = async () => {
     setError('')
@@ -441,8 +465,8 @@ export default function App() {
       }
 
       await API.saveManifest(projectId, manifest)
-      const { job_id } = await API.generateImages(projectId)
-      setJobId(job_id); setPhase('generating')
+      const { job_id } = await API.generateImages(projectId, canResume)
+      setJobData(null); setJobId(job_id); setPhase('generating')
     } catch(e) {
       setError(`Failed to start: ${e.message}`)
       setSubmitting(false)
@@ -494,8 +518,13 @@ export default function App() {
         {phase==='generating' && (
           <Card>
             <div style={{display:'flex',justifyContent:'space-between',marginBottom:12}}>
-              <span style={{fontFamily:'Cinzel,serif',fontSize:15,color:'var(--parchment)'}}>⏳ Generating page images…</span>
-              <span style={{fontFamily:'Cinzel,serif',fontSize:13,color:'var(--gold-light)'}}>{jobData?.progress||0}%</span>
+              <span style={{fontFamily:'Cinzel,serif',fontSize:15,color:'var(--parchment)'}}>
+                {jobData?.queue ? `⏳ Waiting in queue — position ${jobData.queue}` : '⏳ Generating page images…'}
+              </span>
+              <div style={{display:'flex',alignItems:'center',gap:12}}>
+                <span style={{fontFamily:'Cinzel,serif',fontSize:13,color:'var(--gold-light)'}}>{jobData?.progress||0}%</span>
+                <Btn variant="ghost" small onClick={()=>API.cancelJob(jobId)}>Cancel</Btn>
+              </div>
             </div>
             <ProgressBar pct={jobData?.progress||0} error={false} />
             {jobData?.log?.length>0 && (
@@ -506,6 +535,14 @@ export default function App() {
                 ))}
               </div>
             )}
+            {jobData?.pages && (
+              <div style={{marginTop:14,display:'grid',gridTemplateColumns:'repeat(auto-fill,minmax(110px,1fr))',gap:8}}>
+                {Object.entries(jobData.pages).sort(([a],[b])=>a-b).map(([n,url])=>(
+                  <img key={n} src={`${url}&w=256&fmt=webp`} alt={n==='0'?'Title Page':`Page ${n}`}
+                    style={{width:'100%',display:'block',borderRadius:6}} />
+                ))}
+              </div>
+            )}
           </Card>
         )}
 
@@ -801,7 +838,7 @@ export default function App() {
                 </div>
               )}
               <Btn onClick={handleGenerate} disabled={submitting||!projectId} style={{fontSize:17,padding:'14px 48px',borderRadius:10}}>
-                {submitting ? '⏳ Uploading…' : '🖼 Generate Page Images'}
+                {submitting ? '⏳ Uploading…' : canResume ? '🖼 Resume Page Images' : '🖼 Generate Page Images'}
               </Btn>
               <p style={{color:'var(--text-muted)',fontSize:13,marginTop:14,fontStyle:'italic'}}>
                 Step 1 of 2 — generates images only so you can review before spending tokens on video.